@@ -0,0 +1,123 @@
+"""
+Compute backends of the light shading and shadow casting kernels.
+
+All the backends are providing the same kernel interface:
+
+ - light_kernel(rgb_array, alpha_array, light_intensity, red, green, blue, destination, destination_alpha,
+                volume_array=None)
+        fused light shading written straight into the light surface buffers (see CreateLight.fused_surface)
+
+ - visibility_polygon(segments, x, y, angles=None)
+        shadow casting, returns the visibility polygon (m, 3) float64 (x, y, angle) sorted by angle
+        (see Shadow.update)
+
+ - grid_visibility_polygon(grid, x, y, angles=None)
+        shadow casting through a segment grid (see SegmentGrid.py), same polygon than visibility_polygon
+
+Backends :
+
+ - 'cython' : typed kernels with OpenMP (CythonVersion/Kernels.pyx, compiled module kernels,
+              see CythonVersion/setup_Kernels.py)
+ - 'numba'  : @njit(parallel=True) kernels compiled at runtime (NumbaKernels.py, requires numba)
+ - 'numpy'  : NumPy light kernel and vectorized shadow casting (LightKernels.py and ShadowKernels.py),
+              always available
+
+The backend is selected once at runtime (get_backend), the first backend available in BACKENDS is used unless
+the environment variable LIGHT_BACKEND forces a backend e.g
+
+    LIGHT_BACKEND=numba python LightDemo.py
+
+A backend that cannot be loaded falls back to the next available backend (down to 'numpy').
+
+This code comes with a MIT license.
+
+Copyright (c) 2018 Yoann Berenguer
+
+Please acknowledge and give reference if using the source code for your project
+"""
+
+__author__ = "Yoann Berenguer"
+__copyright__ = "Copyright 2007."
+__credits__ = ["Yoann Berenguer"]
+__license__ = "MIT License"
+__version__ = "2.0.0"
+__maintainer__ = "Yoann Berenguer"
+__email__ = "yoyoberenguer@hotmail.com"
+__status__ = "Demo"
+
+import os
+from collections import namedtuple
+
+Backend = namedtuple('Backend', ('name', 'light_kernel', 'visibility_polygon', 'grid_visibility_polygon'))
+
+# Backend names in order of preference (fastest first)
+CYTHON_BACKEND = 'cython'
+NUMBA_BACKEND = 'numba'
+NUMPY_BACKEND = 'numpy'
+BACKENDS = (CYTHON_BACKEND, NUMBA_BACKEND, NUMPY_BACKEND)
+
+# Environment variable forcing a backend
+BACKEND_ENV = 'LIGHT_BACKEND'
+
+# Backend selected by get_backend
+BACKEND = None
+
+
+def load_backend(name_: str) -> Backend:
+    """
+    Import the kernels of a backend.
+
+    :param name_: backend name (see BACKENDS)
+    :return: Backend (name, light_kernel, visibility_polygon, grid_visibility_polygon)
+    :raise ImportError: if the backend is not available on this machine
+    """
+    assert name_ in BACKENDS, 'Expecting %s for argument name_ got %s ' % (BACKENDS, name_)
+
+    if name_ == CYTHON_BACKEND:
+        try:
+            import kernels
+        except ImportError:
+            # extension built in place (CythonVersion/setup_Kernels.py)
+            from CythonVersion import kernels
+        return Backend(name_, kernels.light_kernel, kernels.visibility_polygon, kernels.grid_visibility_polygon)
+
+    if name_ == NUMBA_BACKEND:
+        import NumbaKernels
+        return Backend(name_, NumbaKernels.light_kernel, NumbaKernels.visibility_polygon,
+                       NumbaKernels.grid_visibility_polygon)
+
+    import LightKernels
+    import ShadowKernels
+    return Backend(name_, LightKernels.light_kernel, ShadowKernels.visibility_polygon,
+                   ShadowKernels.grid_visibility_polygon)
+
+
+def select_backend(name_: str = None) -> Backend:
+    """
+    Select the backend used by get_backend.
+
+    :param name_: backend name (see BACKENDS) or None for the environment variable LIGHT_BACKEND,
+                  the fastest backend available is selected if neither of them is set.
+    :return: Backend selected, the next available backend if name_ cannot be loaded
+    """
+    global BACKEND
+
+    name = name_ if name_ is not None else os.environ.get(BACKEND_ENV)
+    if name is not None and name not in BACKENDS:
+        print('[-] Unknown backend %s, expecting %s' % (name, BACKENDS))
+        name = None
+
+    candidates = BACKENDS if name is None else (name, *BACKENDS[BACKENDS.index(name) + 1:])
+    for candidate in candidates:
+        try:
+            BACKEND = load_backend(candidate)
+        except ImportError as error:
+            if candidate == name:
+                print('[-] Backend %s is not available (%s)' % (name, error))
+            continue
+        return BACKEND
+
+
+def get_backend() -> Backend:
+    """ return the backend selected (see select_backend), selected on first call """
+    return BACKEND if BACKEND is not None else select_backend()
@@ -0,0 +1,375 @@
+"""
+Light effect benchmarks and checks (run python Benchmark.py from the project directory, the Assets directory
+must be reachable).
+
+surface_format : time spent by the sprite group draw (All.draw(SCREEN)) for every light surface pixel format
+                 (see CreateLight.SURFACE_FORMAT)
+threads        : time spent updating the lights for different thread pool sizes (see ShowLight.update_lights)
+tiled          : light map composition time, full screen light map against the tiled light map
+                 (see Compositor.TiledLightMap)
+backends       : fused light kernel and shadow casting time (all the segments and segment grid) for every
+                 compute backend available (see Backends.py)
+
+Checks (differences against a reference implementation, 0 is expected unless specified otherwise) :
+
+shadows        : visibility polygons of every compute backend against the segment dicts implementation
+                 (Shadow.get_intersection) for random ray origins
+shadow_updates : visibility polygons of Shadow.update (rays cast at the unique corners, polygon cached until the
+                 origin or the segments change, with and without segment grid) against the segment dicts
+                 implementation, before and after the segments are changed
+kernels        : largest difference between the fixed-point and the float light kernels (1 LSB expected)
+renderers      : largest difference between the frames of the layered renderer and the sprite renderer
+
+This code comes with a MIT license.
+
+Copyright (c) 2018 Yoann Berenguer
+
+Please acknowledge and give reference if using the source code for your project
+"""
+
+__author__ = "Yoann Berenguer"
+__copyright__ = "Copyright 2007."
+__credits__ = ["Yoann Berenguer"]
+__license__ = "MIT License"
+__version__ = "2.0.0"
+__maintainer__ = "Yoann Berenguer"
+__email__ = "yoyoberenguer@hotmail.com"
+__status__ = "Demo"
+
+import time
+import math
+from LightDemo import *
+from ShadowKernels import RAY_OFFSET
+from Backends import BACKENDS, load_backend
+from SegmentGrid import SegmentGrid
+
+
+def create_lights() -> pygame.sprite.RenderUpdates:
+    """ Create all the lights defined in Constants.LIGHTS and return the sprite group to draw """
+    LIGHT_GROUP = pygame.sprite.Group()
+    All = pygame.sprite.RenderUpdates()
+    ShowLight.containers = LIGHT_GROUP, All
+    # create a dummy surface
+    ShowLight.images = pygame.Surface((1, 1), 32)
+
+    for light in LIGHTS:
+        ShowLight(light)
+    return All
+
+
+def surface_format(frames_: int = 200) -> dict:
+    """
+    Measure the sprite group draw time for every light surface pixel format.
+
+    :param frames_: number of frames drawn for each format
+    :return: dict {format: average draw time in ms}
+    """
+    All = create_lights()
+    results = {}
+
+    for surface_format_ in SURFACE_FORMATS:
+        CreateLight.SURFACE_FORMAT = surface_format_
+
+        # re-build every light surface with the selected pixel format
+        for sprite in All:
+            if not sprite.mouse:
+                sprite.spotlight(sprite.chunk, sprite.alpha, sprite.color_index)
+
+        elapsed = 0
+        for frame in range(frames_):
+            SCREEN.blit(TEXTURE1, (0, 0))
+            t = time.perf_counter()
+            CreateLight.draw(All, SCREEN)
+            elapsed += time.perf_counter() - t
+
+        results[surface_format_] = elapsed * 1000 / frames_
+
+    CreateLight.SURFACE_FORMAT = None
+    return results
+
+
+def threads(frames_: int = 100, workers_=(0, 2, 4, 8)) -> dict:
+    """
+    Measure the lights update time for different thread pool sizes (0 for the serial update).
+
+    :param frames_: number of frames updated for each pool size
+    :param workers_: thread pool sizes
+    :return: dict {threads: average update time in ms}
+    """
+    All = create_lights()
+    results = {}
+
+    for workers in workers_:
+        executor = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        t = time.perf_counter()
+        for frame in range(frames_):
+            # every light is due for a new frame
+            for sprite in All:
+                sprite.dt = sprite.timing + 1
+            ShowLight.update_lights(All, executor)
+        results[workers] = (time.perf_counter() - t) * 1000 / frames_
+        if executor is not None:
+            executor.shutdown()
+
+    return results
+
+
+def tiled(frames_: int = 100, workers_: int = 4) -> dict:
+    """
+    Measure the light map composition time (full screen light map, tiled light map serial and threaded).
+
+    :param frames_: number of frames composed for each compositor
+    :param workers_: thread pool size of the threaded tiled light map
+    :return: dict {compositor: average composition time in ms}
+    """
+    CreateLight.LIGHTMAP = True
+    All = create_lights()
+    executor = ThreadPoolExecutor(max_workers=workers_)
+    compositors = {'lightmap': LightMap(RGB1, TEXTURE1.get_alpha() / 255),
+                   'tiled': TiledLightMap(RGB1, TEXTURE1.get_alpha() / 255),
+                   'tiled %s threads' % workers_: TiledLightMap(RGB1, TEXTURE1.get_alpha() / 255, executor)}
+    results = dict.fromkeys(compositors, 0)
+
+    for frame in range(frames_):
+        for sprite in All:
+            sprite.dt = sprite.timing + 1
+        ShowLight.update_lights(All)
+        for name, compositor in compositors.items():
+            t = time.perf_counter()
+            compositor.draw(All, SCREEN)
+            results[name] += time.perf_counter() - t
+
+    executor.shutdown()
+    CreateLight.LIGHTMAP = False
+    return {name: elapsed * 1000 / frames_ for name, elapsed in results.items()}
+
+
+def backends(frames_: int = 50) -> dict:
+    """
+    Measure the fused light kernel (all the lights) and the shadow casting kernels (all the segments and
+    segment grid) of every compute backend available.
+
+    :param frames_: number of frames calculated for each backend
+    :return: dict {backend: (light kernel time in ms, shadow casting time in ms, grid shadow casting time in ms)}
+    """
+    All = create_lights()
+    lights = []
+    for sprite in All:
+        if not sprite.mouse:
+            w, h = sprite.chunk.shape[:2]
+            lights.append((sprite.chunk, sprite.alpha, sprite.light_intensity, sprite.light_shade,
+                           numpy.empty((w, h, 3), numpy.uint8), numpy.empty((w, h), numpy.uint8)))
+    segments = Shadow(ALL_SEGMENTS).segment_array
+    grid = SegmentGrid(segments, 32).index()
+    results = {}
+
+    for name in BACKENDS:
+        try:
+            backend = load_backend(name)
+        except ImportError:
+            continue
+
+        def run(frames):
+            t = time.perf_counter()
+            for frame in range(frames):
+                for rgb, alpha, intensity, color, destination, destination_alpha in lights:
+                    backend.light_kernel(rgb, alpha, intensity, color[0], color[1], color[2],
+                                         destination, destination_alpha)
+            light_time = time.perf_counter() - t
+            t = time.perf_counter()
+            for frame in range(frames):
+                backend.visibility_polygon(segments, 333, 595)
+            shadow_time = time.perf_counter() - t
+            t = time.perf_counter()
+            for frame in range(frames):
+                backend.grid_visibility_polygon(grid, 333, 595)
+            return light_time * 1000 / frames, shadow_time * 1000 / frames, (time.perf_counter() - t) * 1000 / frames
+
+        # first run compiles the numba kernels
+        run(1)
+        results[name] = run(frames_)
+
+    return results
+
+
+def reference_polygon(segments_: list, x: float, y: float, ends_=('a',)) -> numpy.ndarray:
+    """
+    Visibility polygon calculated with the segment dicts (Shadow.get_intersection), three rays cast towards
+    the end points of every segment.
+
+    :param segments_: list of segments {"a": {"x": .., "y": ..}, "b": {"x": .., "y": ..}}
+    :param x: ray origin x coordinate
+    :param y: ray origin y coordinate
+    :param ends_: segment end points the rays are cast towards, ('a',) or ('a', 'b')
+    :return: numpy.ndarray (m, 3) float64 intersections (x, y, angle) sorted by angle
+    """
+    intersects = []
+    for end in [segment[end] for segment in segments_ for end in ends_]:
+        angle = math.atan2(end['y'] - y, end['x'] - x)
+        for ray_angle in (angle - RAY_OFFSET, angle, angle + RAY_OFFSET):
+            ray = {"a": {"x": x, "y": y}, "b": {"x": x + math.cos(ray_angle), "y": y + math.sin(ray_angle)}}
+            closest = None
+            for occluder in segments_:
+                intersect = Shadow.get_intersection(ray, occluder)
+                if intersect and (closest is None or intersect["T1"] < closest["T1"]):
+                    closest = intersect
+            if closest:
+                intersects.append((closest["x"], closest["y"], ray_angle))
+    return numpy.array(sorted(intersects, key=lambda k: k[2]), dtype=numpy.float64).reshape(-1, 3)
+
+
+def shadows(origins_: int = 300) -> dict:
+    """
+    Compare the visibility polygons of every compute backend (all the segments and segment grid) with the
+    segment dicts implementation (see reference_polygon), for the static shadow locations and random origins.
+
+    :param origins_: number of random ray origins
+    :return: dict {backend: (mismatching polygons, mismatching grid polygons, origins)}
+    """
+    segments = Shadow(ALL_SEGMENTS).segment_array
+    grid = SegmentGrid(segments, 32).index()
+    rng = numpy.random.default_rng(0)
+    origins = [(370, 94), (150, 185), (333, 595)] + \
+        [tuple(int(value) for value in rng.integers(1, SCREENRECT.w - 1, 2)) for _ in range(origins_)]
+    references = [reference_polygon(ALL_SEGMENTS, float(x), float(y)) for x, y in origins]
+    results = {}
+
+    for name in BACKENDS:
+        try:
+            backend = load_backend(name)
+        except ImportError:
+            continue
+
+        mismatches = [0, 0]
+        for (x, y), reference in zip(origins, references):
+            if not numpy.array_equal(backend.visibility_polygon(segments, float(x), float(y)), reference):
+                mismatches[0] += 1
+            if not numpy.array_equal(backend.grid_visibility_polygon(grid, float(x), float(y)), reference):
+                mismatches[1] += 1
+        results[name] = (*mismatches, len(origins))
+
+    return results
+
+
+def shadow_updates(origins_: int = 100) -> tuple:
+    """
+    Compare the visibility polygons of Shadow.update (with and without segment grid) with the segment dicts
+    implementation for random origins, then again after a segment is removed and added back (the cached
+    polygons must be re-calculated). The rays of the reference polygon are cast towards both end points of
+    the segments, the duplicated rays (corners shared by several segments) are removed.
+
+    :param origins_: number of random ray origins
+    :return: tuple (mismatching polygons, mismatching grid polygons, polygons compared)
+    """
+    shadow, grid_shadow = Shadow(ALL_SEGMENTS), Shadow(ALL_SEGMENTS, cell_size_=32)
+    segment = POLYGON1[0]
+    remaining = [occluder for occluder in ALL_SEGMENTS if occluder is not segment]
+    rng = numpy.random.default_rng(1)
+    mismatches = [0, 0]
+    compared = 0
+
+    for x, y in [tuple(int(value) for value in rng.integers(1, SCREENRECT.w - 1, 2)) for _ in range(origins_)]:
+        for change, segments in ((None, ALL_SEGMENTS), ('remove_segment', remaining), ('add_segment', ALL_SEGMENTS)):
+            for shadow_ in (shadow, grid_shadow):
+                shadow_.update((x, y))
+                if change is not None:
+                    getattr(shadow_, change)(segment)
+                    shadow_.update((x, y))
+
+            reference = reference_polygon(segments, float(x), float(y), ('a', 'b'))
+            reference = reference[numpy.r_[True, (reference[1:] != reference[:-1]).any(axis=1)]]
+            mismatches[0] += not numpy.array_equal(shadow.intersects, reference)
+            mismatches[1] += not numpy.array_equal(grid_shadow.intersects, reference)
+            compared += 1
+
+    return (*mismatches, compared)
+
+
+def kernels(frames_: int = 20) -> int:
+    """
+    Shade the animated frames of every light with the float and the fixed-point kernels.
+
+    :param frames_: number of frames (color index and light counter) shaded for each light
+    :return: int; largest difference between the two kernels (per color component)
+    """
+    All = create_lights()
+    difference = 0
+    for sprite in All:
+        if sprite.mouse:
+            continue
+        for frame in range(frames_):
+            sprite.counter = frame
+            color_index = frame * 254 // max(1, frames_ - 1)
+            surfaces = []
+            for kernel in (FLOAT_KERNEL, FIXED_KERNEL):
+                sprite.kernel = kernel
+                sprite.spotlight(sprite.chunk, sprite.alpha, color_index)
+                surfaces.append(pygame.surfarray.array3d(sprite.image).astype(numpy.int16))
+            difference = max(difference, int(numpy.abs(surfaces[0] - surfaces[1]).max()))
+        sprite.kernel = None
+    return difference
+
+
+def renderers(frames_: int = 20) -> dict:
+    """
+    Draw the frames with the layered renderer (static layer) and the sprite renderer, for the lights in the
+    group order and with the static lights drawn first (baked).
+
+    :param frames_: number of frames drawn
+    :return: dict {drawing order: (largest difference per color component, number of lights baked)}
+    """
+    All = create_lights()
+    shadows_ = [Shadow(ALL_SEGMENTS, static_=True, location_=(333, 595))]
+    orders = {'group order': list(All),
+              'static lights first': sorted(All, key=lambda light: not light.is_static())}
+    results = {}
+
+    for name, lights in orders.items():
+        layered = LayeredRenderer(TEXTURE1, shadows_, CreateLight.draw)
+        sprite_renderer = SpriteRenderer(TEXTURE1, shadows_, CreateLight.draw)
+        frame, reference = pygame.Surface(SCREEN.get_size()).convert(), pygame.Surface(SCREEN.get_size()).convert()
+        difference = 0
+        for _ in range(frames_):
+            for sprite in All:
+                sprite.dt = sprite.timing + 1
+            ShowLight.update_lights(All)
+            layered.draw(lights, frame, MOUSE_POS)
+            sprite_renderer.draw(lights, reference, MOUSE_POS)
+            difference = max(difference, int(numpy.abs(pygame.surfarray.array3d(frame).astype(numpy.int16) -
+                                                       pygame.surfarray.array3d(reference)).max()))
+        results[name] = (difference, len(layered.split(lights, ordered_=True)[0]))
+    return results
+
+
+if __name__ == '__main__':
+
+    print('\nSprite group draw time per frame (%s lights)' % len(LIGHTS))
+    for name, ms in surface_format().items():
+        print('  %-14s : %.3f ms' % (name, ms))
+
+    print('\nLights update time per frame')
+    for workers, ms in threads().items():
+        print('  %2s threads : %.3f ms' % (workers, ms))
+
+    print('\nLight map composition time per frame')
+    for name, ms in tiled().items():
+        print('  %-16s : %.3f ms' % (name, ms))
+
+    print('\nCompute backends time per frame (light kernel / shadow casting / shadow casting with grid)')
+    for name, (light_ms, shadow_ms, grid_ms) in backends().items():
+        print('  %-6s : %.3f ms / %.3f ms / %.3f ms' % (name, light_ms, shadow_ms, grid_ms))
+
+    print('\nVisibility polygons different from the segment dicts implementation (all the segments / grid)')
+    for name, (mismatches, grid_mismatches, origins) in shadows().items():
+        print('  %-6s : %s / %s of %s origins' % (name, mismatches, grid_mismatches, origins))
+
+    print('\nShadow.update polygons different from the segment dicts implementation (all the segments / grid)')
+    print('  %s / %s of %s polygons' % shadow_updates())
+
+    print('\nLargest difference between the fixed-point and the float light kernels : %s' % kernels())
+
+    print('\nLargest difference between the layered renderer and the sprite renderer frames')
+    for name, (difference, baked) in renderers().items():
+        print('  %-19s : %s (%s lights baked)' % (name, difference, baked))
+
+    pygame.quit()
@@ -0,0 +1,389 @@
+"""
+Light compositors.
+
+Lights that never change (see CreateLight.is_static) are baked once into a cached static layer,
+the layer is re-baked only when a static light is added, removed or changed (see StaticLayer).
+
+SpriteRenderer : the background texture, the lights (alpha blended in the sprite group order) and the shadows
+                 are drawn every frame.
+
+LayeredRenderer : sprite renderer, the background texture and the static lights are baked into a base surface,
+                  every frame the other lights and the shadows are drawn on top. The lights are alpha blended
+                  in order, a static light is only baked if moving it under the lights drawn before it does
+                  not change the frame (see StaticLayer.split).
+
+LightMap : every light contribution (premultiplied light coefficient, see CreateLight.light_coefficient)
+           is accumulated into one screen sized uint16 light map, the light map is then applied to the
+           background texture in a single multiply and clamp pass and the frame is written once.
+           Lights are additive in this mode and overlapping lights do not require an extra full surface
+           blend per light.
+
+TiledLightMap : light map split into fixed tiles (64x64), every dynamic light is binned into the tiles
+                overlapped by its light area and the tiles are shaded independently by a thread pool.
+                Tiles without dynamic lights are not shaded again (unless the static layer changes).
+
+This code comes with a MIT license.
+
+Copyright (c) 2018 Yoann Berenguer
+
+Please acknowledge and give reference if using the source code for your project
+"""
+
+__author__ = "Yoann Berenguer"
+__copyright__ = "Copyright 2007."
+__credits__ = ["Yoann Berenguer"]
+__license__ = "MIT License"
+__version__ = "2.0.0"
+__maintainer__ = "Yoann Berenguer"
+__email__ = "yoyoberenguer@hotmail.com"
+__status__ = "Demo"
+
+import numpy
+import pygame
+from LightKernels import FIXED_KERNEL
+
+
+class StaticLayer:
+    """ Keep track of the static lights baked into a cached layer. """
+
+    def __init__(self):
+        # static light signatures {light id: signature} of the current layer
+        self.signatures = None
+
+    def invalidate(self):
+        """ Force the static layer to be re-baked """
+        self.signatures = None
+
+    def split(self, lights_, ordered_: bool = False) -> tuple:
+        """
+        Classify the lights and check the static layer.
+        Static lights changed since the last bake are rebuilt (see ShowLight.refresh).
+
+        :param lights_: iterable of lights (e.g the sprite group)
+        :param ordered_: bool; True if the lights are blended in order (sprite renderer), a static light
+                         overlapping a light drawn before it that is not baked is then kept with the dynamic
+                         lights (drawn every frame at its place in the drawing order). The static lights drawn
+                         after a moving light (see CreateLight.is_moving) are never baked, the classification
+                         does not depend on the light positions and does not change every frame.
+        :return: tuple (static lights, dynamic lights, True if the static layer must be re-baked)
+        """
+        static, dynamic = [], []
+        # areas of the lights not baked drawn so far, True after a moving light (sprite renderer)
+        rects = []
+        moving = False
+        for light in lights_:
+            if ordered_ and light.is_moving():
+                moving = True
+            if light.is_static() and not (ordered_ and (moving or light.rect.collidelist(rects) != -1)):
+                static.append(light)
+            else:
+                dynamic.append(light)
+                rects.append(light.rect)
+
+        signatures = {light._id: light.static_signature() for light in static}
+        if signatures == self.signatures:
+            return static, dynamic, False
+
+        if self.signatures is not None:
+            for light in static:
+                signature = self.signatures.get(light._id)
+                if signature is not None and signature != signatures[light._id]:
+                    light.refresh()
+
+        self.signatures = signatures
+        return static, dynamic, True
+
+
+class SpriteRenderer:
+    """ Sprite renderer, the background, all the lights and the shadows are drawn every frame. """
+
+    def __init__(self, background_: pygame.Surface, shadows_, draw_):
+        """
+        :param background_: pygame.Surface background texture (e.g TEXTURE1)
+        :param shadows_: list of Shadow instances drawn over the lights (the static shadows are projected
+                         and rendered once, see Shadow.visibility_surface)
+        :param draw_: function drawing a list of lights onto a surface (e.g CreateLight.draw)
+        """
+        self.background = background_
+        self.shadows = list(shadows_)
+        self.draw_lights = draw_
+
+    def draw(self, lights_, surface_: pygame.Surface, mouse_position_: tuple):
+        """
+        Draw the frame onto surface_.
+
+        :param lights_: iterable of lights (e.g the sprite group)
+        :param surface_: pygame.Surface receiving the frame (e.g SCREEN)
+        :param mouse_position_: mouse position (dynamic shadows)
+        """
+        self.compose(lights_, surface_, self.update_shadows(mouse_position_))
+
+    def update_shadows(self, mouse_position_: tuple) -> list:
+        """
+        Project the shadows (static shadows are only projected once, see Shadow.update).
+
+        :param mouse_position_: mouse position
+        :return: list of visibility polygons (one per shadow)
+        """
+        polygons = []
+        for shadow in self.shadows:
+            shadow.update(mouse_position_)
+            polygons.append(shadow.intersects)
+        return polygons
+
+    def compose(self, lights_, surface_: pygame.Surface, polygons_: list):
+        """
+        Draw the background, the lights (in drawing order) and the shadows onto surface_.
+
+        :param lights_: iterable of lights (e.g the sprite group or Pipeline.LightFrame)
+        :param surface_: pygame.Surface receiving the frame (e.g SCREEN)
+        :param polygons_: visibility polygons returned by update_shadows
+        """
+        surface_.fill((0, 0, 0))
+        surface_.blit(self.background, (0, 0))
+        self.draw_lights(lights_, surface_)
+        for shadow, polygon in zip(self.shadows, polygons_):
+            shadow.render_frame(surface_, polygon)
+
+
+class LayeredRenderer(SpriteRenderer, StaticLayer):
+    """ Sprite renderer with a baked static layer (background and static lights). """
+
+    def __init__(self, background_: pygame.Surface, shadows_, draw_):
+        """
+        :param background_: pygame.Surface background texture (e.g TEXTURE1)
+        :param shadows_: list of Shadow instances drawn over the lights (the static shadows are projected
+                         and rendered once, see Shadow.visibility_surface)
+        :param draw_: function drawing a list of lights onto a surface (e.g CreateLight.draw)
+        """
+        SpriteRenderer.__init__(self, background_, shadows_, draw_)
+        StaticLayer.__init__(self)
+        self.base = None
+
+    def bake(self, static_lights_, size_: tuple):
+        """ Render the background and the static lights into the base layer """
+        if self.base is None or self.base.get_size() != size_:
+            self.base = pygame.Surface(size_).convert()
+
+        self.base.fill((0, 0, 0))
+        self.base.blit(self.background, (0, 0))
+        self.draw_lights(static_lights_, self.base)
+
+    def compose(self, lights_, surface_: pygame.Surface, polygons_: list):
+        """
+        Draw the base layer, the lights not baked (in drawing order) and the shadows onto surface_.
+
+        :param lights_: iterable of lights (e.g the sprite group or Pipeline.LightFrame)
+        :param surface_: pygame.Surface receiving the frame (e.g SCREEN)
+        :param polygons_: visibility polygons returned by update_shadows
+        """
+        static, dynamic, rebake = self.split(lights_, ordered_=True)
+        if rebake or self.base is None or self.base.get_size() != surface_.get_size():
+            self.bake(static, surface_.get_size())
+
+        surface_.blit(self.base, (0, 0))
+        self.draw_lights(dynamic, surface_)
+        for shadow, polygon in zip(self.shadows, polygons_):
+            shadow.render_frame(surface_, polygon)
+
+
+class LightMap(StaticLayer):
+    """
+    Screen sized light accumulation buffer (uint16 with SHIFT fractional bits).
+    The static lights are accumulated once into a base light map (ambient + static lights).
+    """
+
+    SHIFT = 8
+
+    def __init__(self, rgb_array_: numpy.ndarray, ambient_: float = 0.0):
+        """
+        :param rgb_array_: numpy.ndarray (w, h, 3) uint8 background texture (e.g RGB1)
+        :param ambient_: float; ambient light applied to the whole background texture (0.0 - 1.0)
+        """
+        assert isinstance(rgb_array_, numpy.ndarray), \
+            'Expecting numpy.ndarray for argument rgb_array_ got %s ' % type(rgb_array_)
+        assert 0.0 <= ambient_ <= 1.0, 'argument ambient_ should be in range [0.0 ... 1.0] got %s ' % ambient_
+
+        StaticLayer.__init__(self)
+        self.rgb_array = rgb_array_
+        self.ambient = int(round(ambient_ * (1 << self.SHIFT)))
+        self.lightmap = numpy.full(rgb_array_.shape, self.ambient, dtype=numpy.uint16)
+        self.base = self.lightmap.copy()
+        self.scratch = numpy.empty(rgb_array_.shape, dtype=numpy.uint32)
+
+    def clear(self):
+        """ Reset the light map to the ambient light and the static lights """
+        numpy.copyto(self.lightmap, self.base)
+
+    def accumulate(self, light_, area_: pygame.Rect = None):
+        """
+        Add a light contribution to the light map (saturating add).
+
+        :param light_: CreateLight instance with an up to date light coefficient
+        :param area_: area of the light map to update (screen coordinates), default the whole light area
+        """
+        coefficient = light_.coefficient
+        if coefficient is None:
+            return
+
+        light_area = light_.light_area()[0]
+        area = light_area if area_ is None else light_area.clip(area_)
+        if area.width == 0 or area.height == 0:
+            return
+
+        # coefficient area matching the light map area
+        x, y = area.left - light_area.left, area.top - light_area.top
+        coefficient = coefficient[x:x + area.width, y:y + area.height]
+        region = self.lightmap[area.left:area.right, area.top:area.bottom]
+        scratch = self.scratch[area.left:area.right, area.top:area.bottom]
+
+        # convert the light coefficient to the light map precision
+        if light_.coefficient_key[0] == FIXED_KERNEL:
+            shift = light_.fixed_point[1] - self.SHIFT
+            if shift >= 0:
+                numpy.right_shift(coefficient, shift, out=scratch)
+            else:
+                numpy.left_shift(coefficient, -shift, out=scratch)
+        else:
+            numpy.multiply(coefficient, 1 << self.SHIFT, out=scratch, casting='unsafe')
+
+        numpy.add(scratch, region, out=scratch)
+        numpy.minimum(scratch, 0xffff, out=scratch)
+        numpy.copyto(region, scratch, casting='unsafe')
+
+    def apply(self, surface_: pygame.Surface, area_: pygame.Rect = None):
+        """
+        Apply the light map to the background texture and write the result into surface_.
+
+        :param surface_: pygame.Surface, same size than the background texture (e.g SCREEN)
+        :param area_: area to apply (screen coordinates), default the whole light map
+        """
+        # the view is locking the surface and must be released before blitting
+        rgb = pygame.surfarray.pixels3d(surface_)
+        self.write(rgb, surface_.get_rect() if area_ is None else area_)
+        del rgb
+
+    def write(self, rgb_: numpy.ndarray, area_: pygame.Rect):
+        """
+        Apply the light map to the background texture and write the result into an array.
+
+        :param rgb_: numpy.ndarray (w, h, 3) uint8 receiving the frame (e.g pixels3d view of the screen)
+        :param area_: area to apply (screen coordinates)
+        """
+        x, y = slice(area_.left, area_.right), slice(area_.top, area_.bottom)
+        scratch = self.scratch[x, y]
+
+        numpy.multiply(self.rgb_array[x, y], self.lightmap[x, y], out=scratch)
+        numpy.right_shift(scratch, self.SHIFT, out=scratch)
+        numpy.minimum(scratch, 255, out=scratch)
+        numpy.copyto(rgb_[x, y], scratch, casting='unsafe')
+
+    def draw(self, lights_, surface_: pygame.Surface):
+        """
+        Composite all the lights and write the frame into surface_.
+
+        :param lights_: iterable of CreateLight instances (e.g the sprite group)
+        :param surface_: pygame.Surface receiving the frame (e.g SCREEN)
+        """
+        static, dynamic, rebake = self.split(lights_)
+        if rebake:
+            self.lightmap.fill(self.ambient)
+            for light in static:
+                self.accumulate(light)
+            numpy.copyto(self.base, self.lightmap)
+        else:
+            self.clear()
+
+        for light in dynamic:
+            self.accumulate(light)
+        self.apply(surface_)
+
+
+class TiledLightMap(LightMap):
+    """
+    Light map shaded per tile. The frame is kept in a persistent surface, only the tiles overlapped by a
+    dynamic light (this frame or the previous one) are shaded again, the frame is then copied to the
+    destination surface.
+    """
+
+    TILE = 64
+
+    def __init__(self, rgb_array_: numpy.ndarray, ambient_: float = 0.0, executor_=None):
+        """
+        :param rgb_array_: numpy.ndarray (w, h, 3) uint8 background texture (e.g RGB1)
+        :param ambient_: float; ambient light applied to the whole background texture (0.0 - 1.0)
+        :param executor_: concurrent.futures.ThreadPoolExecutor shading the tiles or None (serial)
+        """
+        LightMap.__init__(self, rgb_array_, ambient_)
+        self.executor = executor_
+        w, h = rgb_array_.shape[:2]
+        # tile areas {(column, row): pygame.Rect}
+        self.tiles = {(x // self.TILE, y // self.TILE):
+                      pygame.Rect(x, y, min(self.TILE, w - x), min(self.TILE, h - y))
+                      for x in range(0, w, self.TILE) for y in range(0, h, self.TILE)}
+        # tiles shaded with dynamic lights in the previous frame
+        self.dirty = set(self.tiles)
+        self.frame = None
+
+    def bins(self, lights_) -> dict:
+        """
+        Bin the lights into the tiles overlapped by their light area (see CreateLight.light_area).
+
+        :param lights_: iterable of CreateLight instances
+        :return: dict {(column, row): [lights]}
+        """
+        bins = {}
+        for light in lights_:
+            if light.coefficient is None:
+                continue
+            area = light.light_area()[0]
+            if area.width == 0 or area.height == 0:
+                continue
+            for column in range(area.left // self.TILE, (area.right - 1) // self.TILE + 1):
+                for row in range(area.top // self.TILE, (area.bottom - 1) // self.TILE + 1):
+                    bins.setdefault((column, row), []).append(light)
+        return bins
+
+    def shade_tile(self, rgb_: numpy.ndarray, tile_: tuple, lights_):
+        """ Shade one tile (base light map + dynamic lights) and write it into rgb_ """
+        area = self.tiles[tile_]
+        x, y = slice(area.left, area.right), slice(area.top, area.bottom)
+        numpy.copyto(self.lightmap[x, y], self.base[x, y])
+        for light in lights_:
+            self.accumulate(light, area)
+        self.write(rgb_, area)
+
+    def draw(self, lights_, surface_: pygame.Surface):
+        """
+        Composite all the lights and write the frame into surface_.
+
+        :param lights_: iterable of CreateLight instances (e.g the sprite group)
+        :param surface_: pygame.Surface receiving the frame (e.g SCREEN)
+        """
+        static, dynamic, rebake = self.split(lights_)
+        if rebake:
+            self.lightmap.fill(self.ambient)
+            for light in static:
+                self.accumulate(light)
+            numpy.copyto(self.base, self.lightmap)
+
+        if self.frame is None or self.frame.get_size() != surface_.get_size():
+            self.frame = surface_.copy()
+            rebake = True
+
+        bins = self.bins(dynamic)
+        # tiles lit by a dynamic light in the previous frame only are restored to the static light map
+        tiles = set(self.tiles) if rebake else set(bins) | self.dirty
+        self.dirty = set(bins)
+
+        # the tiles are disjoint areas of the light map and of the frame (numpy releases the GIL)
+        rgb = pygame.surfarray.pixels3d(self.frame)
+        if self.executor is None:
+            for tile in tiles:
+                self.shade_tile(rgb, tile, bins.get(tile, ()))
+        else:
+            for future in [self.executor.submit(self.shade_tile, rgb, tile, bins.get(tile, ())) for tile in tiles]:
+                future.result()
+        del rgb
+
+        surface_.blit(self.frame, (0, 0))
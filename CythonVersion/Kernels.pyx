@@ -0,0 +1,277 @@
+"""
+Typed kernels shared by the Cython light engine (LightEngine.pyx), the shadow module (Shadows.pyx) and the
+compute backends (see Backends.py, backend 'cython').
+
+ - light_kernel       : fused light shading written straight into the light surface buffers
+ - visibility_polygon : shadow casting (visibility polygon from a light position)
+ - grid_visibility_polygon : shadow casting through a segment grid (see SegmentGrid.py), each ray walks
+                        through the cells it crosses
+
+The kernels are running without the GIL and processing the rows (rays) in parallel (OpenMP).
+The module does not depend on pygame and can be imported by any of the demos.
+
+    python setup_Kernels.py build_ext --inplace
+
+This code comes with a MIT license.
+
+Copyright (c) 2018 Yoann Berenguer
+
+Please acknowledge and give reference if using the source code for your project
+"""
+
+__author__ = "Yoann Berenguer"
+__copyright__ = "Copyright 2007."
+__credits__ = ["Yoann Berenguer"]
+__license__ = "MIT License"
+__version__ = "2.0.0"
+__maintainer__ = "Yoann Berenguer"
+__email__ = "yoyoberenguer@hotmail.com"
+__status__ = "Demo"
+
+import numpy
+
+cimport cython
+from cython.parallel cimport prange
+from libc.math cimport cos, sin, floor, fabs, INFINITY
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+@cython.cdivision(True)
+cpdef void light_kernel(const unsigned char [:, :, :] rgb_array, const unsigned char [:, :, :] alpha_array,
+                        double light_intensity, unsigned char red, unsigned char green, unsigned char blue,
+                        unsigned char [:, :, :] destination, unsigned char [:, :] destination_alpha,
+                        const unsigned char [:, :, :] volume_array=None):
+    """
+    Fused light kernel, rgb_array * (alpha_array * light_intensity * color [* volume_array / 25]) capped to 255
+    is calculated in a single pass (rows processed in parallel, OpenMP) and written straight into the light
+    surface buffer with the mask alpha.
+
+    :param rgb_array: uint8 memoryview (w, h, 3) representing the area flood with light
+    :param alpha_array: uint8 memoryview (w, h, 1) mask alpha (radial light intensity)
+    :param light_intensity: light intensity
+    :param red: light color red component
+    :param green: light color green component
+    :param blue: light color blue component
+    :param destination: uint8 memoryview (w, h, 3) receiving the light (e.g pixels3d view of the light surface)
+    :param destination_alpha: uint8 memoryview (w, h) receiving the mask alpha (e.g pixels_alpha view)
+    :param volume_array: uint8 memoryview (w, h, 3) volumetric texture or None
+    """
+    cdef:
+        int w = rgb_array.shape[0], h = rgb_array.shape[1]
+        int i, j, c
+        double a, v
+        double color[3]
+        bint volume = volume_array is not None
+
+    if alpha_array.shape[0] < w or alpha_array.shape[1] < h or destination.shape[0] < w or \
+            destination.shape[1] < h or destination_alpha.shape[0] < w or destination_alpha.shape[1] < h or \
+            (volume and (volume_array.shape[0] < w or volume_array.shape[1] < h)):
+        raise ValueError('light_kernel arrays shapes are not matching')
+
+    color[0], color[1], color[2] = red, green, blue
+
+    with nogil:
+        for i in prange(w, schedule='static'):
+            for j in range(h):
+                a = alpha_array[i, j, 0] * light_intensity
+                for c in range(3):
+                    # same operation order than the numpy version (see CreateLight.spotlight)
+                    v = a * color[c]
+                    if volume:
+                        v = v * (volume_array[i, j, c] / 25.0)
+                    v = rgb_array[i, j, c] * v
+                    if v > 255.0:
+                        v = 255.0
+                    destination[i, j, c] = <unsigned char>v
+                destination_alpha[i, j] = alpha_array[i, j, 0]
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef inline double ray_parameter(double r_dx, double r_dy, double r_mag, const double [:, ::1] segments,
+                                 int k, double x, double y) nogil:
+    """ ray parameter T1 of the intersection with the segment k (see Shadow.get_intersection), INFINITY if none """
+    cdef double s_dx, s_dy, s_mag, d, t1, t2
+    s_dx = segments[k, 2] - segments[k, 0]
+    s_dy = segments[k, 3] - segments[k, 1]
+    s_mag = s_dx * s_dx + s_dy * s_dy
+    # parallel lines, no intersection
+    if r_dx / r_mag == s_dx / s_mag and r_dy / r_mag == s_dy / s_mag:
+        return INFINITY
+    d = s_dx * r_dy - s_dy * r_dx
+    if d == 0:
+        d = d - 0.01
+    t2 = (r_dx * (segments[k, 1] - y) + r_dy * (x - segments[k, 0])) / d
+    d = r_dx
+    if d == 0:
+        d = d - 0.01
+    t1 = (segments[k, 0] + s_dx * t2 - x) / d
+    if t1 < 0 or t2 < 0 or t2 > 1:
+        return INFINITY
+    return t1
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+@cython.cdivision(True)
+cpdef visibility_polygon(const double [:, ::1] segments, double x, double y, angles=None):
+    """
+    Typed shadow casting kernel, same algorithm than Shadow.get_intersection and Shadow.update.
+    For each corner, three rays are cast (angle - 0.00001, angle, angle + 0.00001) from (x, y)
+    and the closest intersection with all the segments is kept (rays processed in parallel, OpenMP).
+
+    :param segments: float64 memoryview (n, 4) segment end points (ax, ay, bx, by)
+    :param x: ray origin x coordinate (light or mouse position)
+    :param y: ray origin y coordinate
+    :param angles: float64 array (j, ) angles of the corners (see ShadowKernels.corner_angles),
+                   None to cast the rays towards the end point a of every segment
+    :return: numpy.ndarray (m, 3) float64 C contiguous, intersections (x, y, angle) sorted by angle
+    """
+    if angles is None:
+        segments_ = numpy.asarray(segments)
+        angles = numpy.arctan2(segments_[:, 1] - y, segments_[:, 0] - x)
+    cdef const double [::1] corners = numpy.ascontiguousarray(angles, dtype=numpy.float64)
+
+    cdef:
+        int n = segments.shape[0], rays = 3 * corners.shape[0]
+        int i, k
+        double angle, r_dx, r_dy, r_mag, t1, closest
+
+    points_ = numpy.empty((rays, 3), dtype=numpy.float64)
+    found_ = numpy.zeros(rays, dtype=numpy.uint8)
+    cdef double [:, ::1] points = points_
+    cdef unsigned char [::1] found = found_
+
+    with nogil:
+        for i in prange(rays, schedule='static'):
+            angle = corners[i // 3] + (i % 3 - 1) * 0.00001
+            # same operations than the ray dict (b - a)
+            r_dx = (x + cos(angle)) - x
+            r_dy = (y + sin(angle)) - y
+            r_mag = r_dx * r_dx + r_dy * r_dy
+            closest = INFINITY
+            for k in range(n):
+                t1 = ray_parameter(r_dx, r_dy, r_mag, segments, k, x, y)
+                if t1 < closest:
+                    closest = t1
+            if closest < INFINITY:
+                points[i, 0] = x + r_dx * closest
+                points[i, 1] = y + r_dy * closest
+                points[i, 2] = angle
+            found[i] = closest < INFINITY
+
+    polygon = points_[found_.view(dtype=numpy.bool_)]
+    # stable sort, rays with identical angles are kept in the casting order (same as sorted())
+    return numpy.ascontiguousarray(polygon[numpy.argsort(polygon[:, 2], kind='stable')])
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+@cython.cdivision(True)
+cpdef grid_visibility_polygon(grid, double x, double y, angles=None):
+    """
+    Typed shadow casting kernel with a segment grid, each ray walks through the cells it crosses (DDA)
+    and is only intersected with the segments of these cells (rays processed in parallel, OpenMP).
+    Same polygon than visibility_polygon with all the segments.
+
+    :param grid: SegmentGrid.GridIndex (see SegmentGrid.index)
+    :param x: ray origin x coordinate (light or mouse position)
+    :param y: ray origin y coordinate
+    :param angles: float64 array (j, ) angles of the corners (see ShadowKernels.corner_angles),
+                   None to cast the rays towards the end point a of every segment
+    :return: numpy.ndarray (m, 3) float64 C contiguous, intersections (x, y, angle) sorted by angle
+    """
+    segments_ = numpy.ascontiguousarray(grid.segments, dtype=numpy.float64)
+    if angles is None:
+        angles = numpy.arctan2(segments_[:, 1] - y, segments_[:, 0] - x)
+
+    cdef:
+        const double [:, ::1] segments = segments_
+        const double [::1] corners = numpy.ascontiguousarray(angles, dtype=numpy.float64)
+        const int [::1] cell_start = numpy.ascontiguousarray(grid.cell_start, dtype=numpy.int32)
+        const int [::1] cell_segments = numpy.ascontiguousarray(grid.cell_segments, dtype=numpy.int32)
+        double left = grid.left, top = grid.top, cell_size = grid.cell_size
+        int columns = grid.columns, rows = grid.rows
+        double right = left + columns * cell_size, bottom = top + rows * cell_size
+        int n = segments.shape[0], rays = 3 * corners.shape[0]
+        int i, k, column, row, step_x, step_y
+        double angle, r_dx, r_dy, r_mag, t1, closest, tx0, tx1, ty0, ty1, t_enter, t_leave
+        double t_max_x, t_max_y, t_delta_x, t_delta_y
+
+    points_ = numpy.empty((rays, 3), dtype=numpy.float64)
+    found_ = numpy.zeros(rays, dtype=numpy.uint8)
+    cdef double [:, ::1] points = points_
+    cdef unsigned char [::1] found = found_
+
+    with nogil:
+        for i in prange(rays, schedule='dynamic'):
+            angle = corners[i // 3] + (i % 3 - 1) * 0.00001
+            # same operations than the ray dict (b - a)
+            r_dx = (x + cos(angle)) - x
+            r_dy = (y + sin(angle)) - y
+            r_mag = r_dx * r_dx + r_dy * r_dy
+            closest = INFINITY
+
+            if r_dx == 0:
+                # vertical ray, T1 is not a distance along the ray, intersected with all the segments
+                for k in range(n):
+                    t1 = ray_parameter(r_dx, r_dy, r_mag, segments, k, x, y)
+                    if t1 < closest:
+                        closest = t1
+            else:
+                # grid entry and exit (slab method)
+                tx0 = (left - x) / r_dx
+                tx1 = (right - x) / r_dx
+                t_enter = max(min(tx0, tx1), 0.0)
+                t_leave = max(tx0, tx1)
+                if r_dy != 0:
+                    ty0 = (top - y) / r_dy
+                    ty1 = (bottom - y) / r_dy
+                    t_enter = max(t_enter, min(ty0, ty1))
+                    t_leave = min(t_leave, max(ty0, ty1))
+                elif y < top or y > bottom:
+                    t_enter = INFINITY
+
+                if t_enter <= t_leave:
+                    column = min(max(<int>floor((x + r_dx * t_enter - left) / cell_size), 0), columns - 1)
+                    row = min(max(<int>floor((y + r_dy * t_enter - top) / cell_size), 0), rows - 1)
+                    step_x = 1 if r_dx > 0 else -1
+                    t_max_x = (left + (column + (1 if r_dx > 0 else 0)) * cell_size - x) / r_dx
+                    t_delta_x = cell_size / fabs(r_dx)
+                    step_y = 0
+                    t_max_y = INFINITY
+                    t_delta_y = INFINITY
+                    if r_dy != 0:
+                        step_y = 1 if r_dy > 0 else -1
+                        t_max_y = (top + (row + (1 if r_dy > 0 else 0)) * cell_size - y) / r_dy
+                        t_delta_y = cell_size / fabs(r_dy)
+
+                    while 0 <= column < columns and 0 <= row < rows:
+                        for k in range(cell_start[row * columns + column], cell_start[row * columns + column + 1]):
+                            t1 = ray_parameter(r_dx, r_dy, r_mag, segments, cell_segments[k], x, y)
+                            if t1 < closest:
+                                closest = t1
+                        # closest intersection within the visited cells
+                        if closest <= min(t_max_x, t_max_y):
+                            break
+                        if t_max_x < t_max_y:
+                            column = column + step_x
+                            t_max_x = t_max_x + t_delta_x
+                        else:
+                            row = row + step_y
+                            t_max_y = t_max_y + t_delta_y
+
+            if closest < INFINITY:
+                points[i, 0] = x + r_dx * closest
+                points[i, 1] = y + r_dy * closest
+                points[i, 2] = angle
+            found[i] = closest < INFINITY
+
+    polygon = points_[found_.view(dtype=numpy.bool_)]
+    # stable sort, rays with identical angles are kept in the casting order (same as sorted())
+    return numpy.ascontiguousarray(polygon[numpy.argsort(polygon[:, 2], kind='stable')])
@@ -77,6 +77,7 @@ from Shadows import Shadow
 import time
 import multiprocessing
 import ctypes
+from kernels import light_kernel
 
 
 class CreateLight(object):
@@ -126,6 +127,8 @@ class CreateLight(object):
         # time between frames default 0ms
         # If animation is lagging, increase self.timing e.g 33ms
         self.timing = 30
+        # Persistent light surfaces (see light_surface)
+        self.surfaces = {}
 
     def gradient(self, index_: int)->numpy.ndarray:
         """ create a color gradient
@@ -233,26 +236,10 @@ class CreateLight(object):
         # alpha_array and rgb_array will not match the array shape of the texture define by self.volume.
         # In short, the volumetric effect will be disable for dynamic light using the mouse position.
         # todo pixels3d / array3d choose the best format according to surface
-        if self.logic1:
-            volume_array = numpy.divide(self.V0[self.counter % len(self.volume)], 25)
-            args = alpha_array * self.light_intensity * color * volume_array
-        else:
-            args = alpha_array * self.light_intensity * color
-
-        # light resultant calculation
-        new_array = numpy.multiply(rgb_array, args) #.astype(numpy.uint16)
-
-        # Cap the array
-        putmask(new_array, new_array > 255, 255)
-        # putmask(new_array, new_array < 0, 0)
-
-        # Build a 3d array (model RGB + A)
-        new = numpy.dstack((new_array, alpha_array))
-
-        # Build the pygame surface (RGBA model)
-        self.image = pygame.image.frombuffer(new.transpose(1, 0, 2).copy('C').astype(numpy.uint8),
-                                       (new.shape[:2][0], new.shape[:2][1]), 'RGBA')
+        volume_array = self.V0[self.counter % len(self.volume)] if self.logic1 else None
 
+        # light resultant calculation (typed kernel writing into the light surface)
+        self.image = self.light_surface('spotlight', rgb_array, alpha_array, color, volume_array)
 
     def flickering(self, rgb_array, alpha_array):
         assert isinstance(rgb_array, numpy.ndarray), \
@@ -261,13 +248,33 @@ class CreateLight(object):
             'Expecting numpy.ndarray for argument alpha_array got %s ' % type(alpha_array)
 
         color = [self.light_shade[0] >> 1, self.light_shade[1] >> 1, self.light_shade[2] >> 1 ]
-        new_array = numpy.multiply(rgb_array, alpha_array * self.light_intensity * color,
-                                   dtype=numpy.float)
-        putmask(new_array, new_array > 255, 255)
-        # putmask(new_array, new_array < 0, 0)
-        new = numpy.dstack((new_array, alpha_array))
-        return pygame.image.frombuffer(new.transpose(1, 0, 2).copy('C').astype(numpy.uint8),
-                                       (new.shape[:2][0], new.shape[:2][1]), 'RGBA')
+        return self.light_surface('flickering', rgb_array, alpha_array, color)
+
+    def light_surface(self, name_: str, rgb_array, alpha_array, color, volume_array=None) -> pygame.Surface:
+        """
+        Shade the light with the typed kernel (light_kernel) straight into the persistent SRCALPHA surface
+        <name_>, the surface is created once and re-used every frame (re-created if the light area changes).
+
+        :param name_: surface name
+        :param rgb_array: numpy.ndarray representing the area flood with light
+        :param alpha_array: numpy.ndarray representing the mask alpha
+        :param color: light color (R, G, B)
+        :param volume_array: numpy.ndarray volumetric texture or None
+        :return: pygame.Surface
+        """
+        size = rgb_array.shape[:2]
+        surface = self.surfaces.get(name_)
+        if surface is None or surface.get_size() != size:
+            surface = pygame.Surface(size, pygame.SRCALPHA, 32)
+            self.surfaces[name_] = surface
+
+        # the views are locking the surface and must be released before blitting
+        rgb = pygame.surfarray.pixels3d(surface)
+        alpha = pygame.surfarray.pixels_alpha(surface)
+        light_kernel(rgb_array, alpha_array, self.light_intensity, color[0], color[1], color[2],
+                     rgb, alpha, volume_array)
+        del rgb, alpha
+        return surface
 
     def offset_calculation(self):
         if self.image.get_size() != self.light_shape:
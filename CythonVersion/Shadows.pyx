@@ -14,7 +14,15 @@ __status__ = "Demo"
 import pygame
 from pygame import gfxdraw
 import math
+import numpy
 from Constants import UNSHADOWED_TEXTURE1, MOUSE_POS, SCREEN
+from kernels import visibility_polygon
+
+# Texture of the visibility polygons without its surface alpha, the alpha is applied per pixel
+# to the pre-rendered polygons (see Shadow.render_polygon)
+OPAQUE_TEXTURE1 = UNSHADOWED_TEXTURE1.copy()
+OPAQUE_TEXTURE1.set_alpha(None)
+TEXTURE_ALPHA = UNSHADOWED_TEXTURE1.get_alpha() if UNSHADOWED_TEXTURE1.get_alpha() is not None else 255
 
 
 class Shadow:
@@ -33,7 +41,36 @@ class Shadow:
         self.location = location_
         self.intersects = []
         self.points = []
-        self.segments = polygons_
+        # pre-rendered visibility polygon and the polygon it was rendered from (see visibility_surface)
+        self.mask = None
+        self.mask_polygon = None
+        # segment list version, incremented every time the segments are changed
+        self.version = 0
+        self.set_segments(polygons_)
+
+    def set_segments(self, segments_: list):
+        """
+        Set the occluder segments and pre-process them for the visibility kernel.
+        The unique corners are built once here, the angles of the rays are calculated once per ray origin.
+        The segments must not be modified in place (the visibility polygon is cached, see update).
+
+        :param segments_: list of segments {"a": {"x": .., "y": ..}, "b": {"x": .., "y": ..}}
+        """
+        assert isinstance(segments_, list), 'Expecting list for ' \
+                                            'argument segments_ got %s ' % type(segments_)
+        self.segments = segments_
+        # segment end points (ax, ay, bx, by)
+        self.segment_array = numpy.array(
+            [(segment['a']['x'], segment['a']['y'], segment['b']['x'], segment['b']['y'])
+             for segment in segments_], dtype=numpy.float64).reshape(-1, 4)
+        # unique segment end points (x, y)
+        self.corners = numpy.unique(self.segment_array.reshape(-1, 2), axis=0)
+        # sorted angles of the corners seen from self.origin (see update)
+        self.angles = None
+        self.origin = None
+        # segment list version and (origin, version) of the cached visibility polygon
+        self.version += 1
+        self.polygon_key = None
 
     @staticmethod
     def get_intersection(ray, segment):
@@ -88,80 +125,90 @@ class Shadow:
         }
 
     def update(self, mouse_position):
+        """
+        Calculate the visibility polygon from the light location (static shadow) or the mouse position.
+        self.intersects is a numpy.ndarray (m, 3) float64 (x, y, angle) sorted by angle (see visibility_polygon)
+        The polygon is re-calculated only when the ray origin or the segments (see set_segments) are changing,
+        static shadows are calculated once.
+
+        :param mouse_position: tuple (x, y) mouse position
+        """
         assert isinstance(mouse_position, tuple), 'Expecting tuple for ' \
                                             'argument mouse_position got %s ' % type(mouse_position)
-        # Clear old points
-        self.points = []
-        for segment in self.segments:
-            self.points.append((segment['a'], segment['b']))
-
-        unique_points = self.points.copy()
-
-        # Get all angles in radian
-        unique_angles = []
-        for point in unique_points:
-            if self.static:
-                angle = math.atan2(point[0]["y"] - self.location[1], point[0]["x"] - self.location[0])
-            else:
-                angle = math.atan2(point[0]["y"] - mouse_position[1], point[0]["x"] - mouse_position[0])
-            point[0]["angle"] = angle
-            # For each (unique) line segment end point,
-            # I cast a ray directly towards it,
-            # plus two more rays offset by +/- 0.00001 radians.
-            # The two extra rays are needed to hit the wall(s) behind any given segment corner.
-            unique_angles.append(angle - 0.00001)
-            unique_angles.append(angle)
-            unique_angles.append(angle + 0.00001)
-
-        # RAYS IN ALL DIRECTIONS
-        self.intersects = []
-        for angle in unique_angles:
-
-            dx = math.cos(angle)
-            dy = math.sin(angle)
-            # Ray,
-            # segment (a) is the mouse position (also ray origin)
-            # segment (b) is the slope or direction
-
-            if self.static:
-                ray = {
-                    "a": {"x": self.location[0], "y": self.location[1]},
-                    "b": {"x": self.location[0] + dx, "y": self.location[1] + dy}
-                }
-            else:
-                ray = {
-                    "a": {"x": mouse_position[0], "y": mouse_position[1]},
-                    "b": {"x": mouse_position[0] + dx, "y": mouse_position[1] + dy}
-                }
-
-            # Find CLOSEST intersection
-            closest_intersect = None
-            for segment in self.segments:
-
-                # return the point of intersection (coordinates x, y, T1) if any (else return None)
-                intersect = self.get_intersection(ray, segment)
-                # if no intersection, loop back
-                if not intersect:
-                    continue
-
-                if not closest_intersect or intersect["T1"] < closest_intersect["T1"]:
-                    closest_intersect = intersect
-
-            if not closest_intersect:
-                continue
-
-            closest_intersect["angle"] = angle
-            self.intersects.append(closest_intersect)
-        self.intersects = sorted(self.intersects, key=lambda k: k['angle'])
+        origin = self.location if self.static else mouse_position
+        key = (origin, self.version)
+        if key == self.polygon_key:
+            return
+
+        if origin != self.origin:
+            self.angles = numpy.unique(numpy.arctan2(self.corners[:, 1] - origin[1], self.corners[:, 0] - origin[0]))
+            self.origin = origin
+        self.intersects = visibility_polygon(self.segment_array, origin[0], origin[1], self.angles)
+        self.polygon_key = key
 
     @staticmethod
     def draw_polygon(polygon):
-        assert isinstance(polygon, list), 'Expecting list for ' \
+        assert isinstance(polygon, (list, numpy.ndarray)), 'Expecting list or numpy.ndarray for ' \
                                                   'argument polygon got %s ' % type(polygon)
-        points = []
-        for intersect in polygon:
-            points.append((intersect['x'], intersect['y']))
+        if isinstance(polygon, numpy.ndarray):
+            points = polygon[:, :2].tolist()
+        else:
+            points = []
+            for intersect in polygon:
+                points.append((intersect['x'], intersect['y']))
         pygame.gfxdraw.textured_polygon(SCREEN, points, UNSHADOWED_TEXTURE1, 0, 0)
 
-    def render_frame(self):
-        self.draw_polygon(self.intersects)
+    @staticmethod
+    def render_polygon(polygon):
+        """
+        Render the textured visibility polygon into a new surface cropped to the polygon bounding box.
+        The texture alpha is applied per pixel, the surface is drawn with a plain blit (same result than
+        draw_polygon within 1 LSB, overlapping spans of the polygon are not blended twice).
+
+        :param polygon: numpy.ndarray (m, 3) (x, y, angle) or list of intersect dicts
+        :return: tuple (pygame.Surface, (left, top)) or None if the polygon is empty
+        """
+        if isinstance(polygon, numpy.ndarray):
+            points = polygon[:, :2]
+        else:
+            points = numpy.array([(intersect['x'], intersect['y']) for intersect in polygon]).reshape(-1, 2)
+        if len(points) < 3:
+            return None
+
+        left, top = int(math.floor(points[:, 0].min())), int(math.floor(points[:, 1].min()))
+        size = (int(math.ceil(points[:, 0].max())) - left + 1, int(math.ceil(points[:, 1].max())) - top + 1)
+        surface = pygame.Surface(size, pygame.SRCALPHA, 32)
+        # the texture stays aligned with the screen (texture offset x is subtracted, y is added)
+        pygame.gfxdraw.textured_polygon(surface, (points - (left, top)).tolist(), OPAQUE_TEXTURE1, -left, top)
+
+        # the views are locking the surface and must be released before converting
+        alpha = pygame.surfarray.pixels_alpha(surface)
+        alpha[alpha > 0] = TEXTURE_ALPHA
+        del alpha
+        return surface.convert_alpha(), (left, top)
+
+    def visibility_surface(self, polygon_=None):
+        """
+        Return the pre-rendered visibility polygon (see render_polygon), rendered once per polygon: static
+        shadows are rendered once, dynamic shadows only when their polygon changes (see update).
+
+        :param polygon_: visibility polygon or None for the current polygon (self.intersects)
+        :return: tuple (pygame.Surface, (left, top)) or None if the polygon is empty
+        """
+        polygon = self.intersects if polygon_ is None else polygon_
+        if polygon is not self.mask_polygon:
+            self.mask = self.render_polygon(polygon)
+            self.mask_polygon = polygon
+        return self.mask
+
+    def render_frame(self, surface_=None, polygon_=None):
+        """
+        Draw the visibility polygon onto surface_ (default SCREEN)
+
+        :param surface_: pygame.Surface or None for SCREEN
+        :param polygon_: visibility polygon or None for the current polygon (e.g polygon computed
+                         ahead by a pipelined frame)
+        """
+        mask = self.visibility_surface(polygon_)
+        if mask is not None:
+            (SCREEN if surface_ is None else surface_).blit(*mask)
@@ -0,0 +1,22 @@
+"""
+Build the typed kernels extension (light kernel and shadow casting with OpenMP),
+the module kernels is imported by LightEngine.pyx, Shadows.pyx and Backends.py
+
+    python setup_Kernels.py build_ext --inplace
+"""
+import sys
+from setuptools import setup, Extension
+from Cython.Build import cythonize
+
+# OpenMP flags (MSVC / gcc and clang)
+if sys.platform == 'win32':
+    openmp_compile, openmp_link = ['/openmp', '/O2'], []
+else:
+    openmp_compile, openmp_link = ['-fopenmp', '-O3'], ['-fopenmp']
+
+setup(
+    ext_modules=cythonize(Extension("kernels", ["Kernels.pyx"],
+                                    extra_compile_args=openmp_compile,
+                                    extra_link_args=openmp_link),
+                          compiler_directives={'language_level': 3})
+)
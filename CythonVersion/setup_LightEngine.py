@@ -1,6 +1,13 @@
-from distutils.core import setup
+"""
+Build the light engine extension (the typed light kernel is built separately, see setup_Kernels.py)
+
+    python setup_LightEngine.py build_ext --inplace
+"""
+from setuptools import setup, Extension
 from Cython.Build import cythonize
 
+# The module is imported as lightEngine (see LightDemoCython.py)
 setup(
-    ext_modules=cythonize("lightEngine.pyx")
+    ext_modules=cythonize(Extension("lightEngine", ["LightEngine.pyx"]),
+                          compiler_directives={'language_level': 3})
 )
@@ -1,6 +1,12 @@
-from distutils.core import setup
+"""
+Build the shadow extension (the typed visibility kernel is built separately, see setup_Kernels.py)
+
+    python setup_Shadows.py build_ext --inplace
+"""
+from setuptools import setup, Extension
 from Cython.Build import cythonize
 
 setup(
-    ext_modules=cythonize("Shadows.pyx")
+    ext_modules=cythonize(Extension("Shadows", ["Shadows.pyx"]),
+                          compiler_directives={'language_level': 3})
 )
@@ -70,23 +70,77 @@ __status__ = "Demo"
 
 
 import numpy
-from numpy import putmask, array, arange, repeat, newaxis
 import random
 import threading
+import math
+from functools import reduce
+from itertools import count
 from Constants import *
 from Shadows import Shadow
+from Compositor import LightMap, LayeredRenderer, SpriteRenderer, TiledLightMap
+from SurfaceCache import SurfaceCache
+from Pipeline import FramePipeline, LightFrame
+from Backends import get_backend
+from LightKernels import KERNELS, FIXED_KERNEL, FLOAT_KERNEL, FUSED_KERNEL, GRADIENT_PING_PONG, fixed_point_scale, gradient_lut, \
+    light_coefficient_fixed, light_coefficient_float, shade_fixed, shade_float, spotlight_batch_float
 import time
 import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+# Light surface formats (see CreateLight.SURFACE_FORMAT)
+NATIVE_FORMAT = 'native'
+PREMULTIPLIED_FORMAT = 'premultiplied'
+SURFACE_FORMATS = (None, NATIVE_FORMAT, PREMULTIPLIED_FORMAT)
 
 
 class CreateLight(object):
 
     UPDATE = False
+    # Default light kernel 'float', 'fixed' or 'fused' (see LightKernels.py, the fused kernel is provided by
+    # the compute backend, see Backends.py), can be overridden per light with the argument kernel_
+    KERNEL = FLOAT_KERNEL
+    # Light surfaces pixel format
+    # None            : 32 bit SRCALPHA surfaces (generic per-pixel alpha blitter)
+    # 'native'        : surfaces converted to the display pixel format (convert_alpha)
+    # 'premultiplied' : display pixel format with premultiplied alpha, to be drawn with BLEND_PREMULTIPLIED
+    SURFACE_FORMAT = None
+    # True to bake the background texture and the static lights into a base layer drawn once per frame
+    # (see Compositor.LayeredRenderer), a static light is only baked when the drawing order allows it.
+    LAYERED = False
+    # True when all the lights are accumulated into a single light map (see Compositor.LightMap)
+    # instead of being drawn as sprites, the lights are then only updating their light coefficient.
+    LIGHTMAP = False
+    # True to shade the light map per tile (see Compositor.TiledLightMap, the tiles are shaded by
+    # the thread pool CreateLight.THREADS)
+    TILED = False
+    # Memory budget in bytes for baking the animation cycle of a periodic light (see ShowLight.bake),
+    # 0 to compute the animated lights live.
+    BAKE_BUDGET = 0
+    # Memory budget in bytes of the rendered light surfaces cache shared by all the animated lights
+    # (see SurfaceCache.py and spotlight), 0 to disable the cache.
+    SURFACE_CACHE_BUDGET = 0
+    # SurfaceCache instance built from SURFACE_CACHE_BUDGET (see the main loop) or None
+    SURFACE_CACHE = None
+    # Light ids (surface cache keys and static layer signatures), never re-used by a later light
+    LIGHT_IDS = count()
+    # Number of threads updating the lights concurrently (see ShowLight.update_lights), 0 to update
+    # the lights serially in the main thread.
+    THREADS = 0
+    # Number of frames computed in a background thread ahead of the frame being presented
+    # (see Pipeline.FramePipeline), 0 to compute and present the frames sequentially.
+    # The light surfaces are then rotated over PIPELINE_DEPTH + 1 buffers.
+    PIPELINE_DEPTH = 0
+    # True to shade the animated lights of the same shape together, stacked into a single array operation
+    # (float kernel only, see ShowLight.shade_batch)
+    BATCH = False
+    # Stacked chunks of the batched lights {(shape, volume): (chunks, stacked chunks)}, re-used until
+    # the lights of the group are changing (see ShowLight.shade_batch)
+    BATCH_CHUNKS = {}
     """ Define a light source properties and methods."""
 
     def __init__(self, light_name_, light_shape_, light_shade_, alpha_mask_, light_flickering_, light_variance_,
                  light_rotating_, light_volume_, start_color_gradient_, end_color_gradient_,
-                 light_intensity_, position_, volume_, mouse_=False):
+                 light_intensity_, position_, volume_, mouse_=False, kernel_=None):
 
         assert isinstance(light_name_, str), 'Expecting str for ' \
                                              'argument light_name_ got %s ' % type(light_name_)
@@ -100,6 +154,8 @@ class CreateLight(object):
                                                     'argument light_flickering_ got %s ' % type(light_flickering_)
         assert isinstance(light_variance_, bool), 'Expecting bool for ' \
                                                   'argument light_variance_ got %s ' % type(light_variance_)
+        assert kernel_ in (None, *KERNELS), 'Expecting %s or None for ' \
+                                           'argument kernel_ got %s ' % (KERNELS, kernel_)
 
         # Light source properties (see module Constants.py for more details about the light source creation)
         self.light_name = light_name_
@@ -115,7 +171,7 @@ class CreateLight(object):
         self.light_intensity = light_intensity_
         self.position = position_
         self.volume = volume_
-        self._id = id(self)
+        self._id = next(CreateLight.LIGHT_IDS)
         self.counter = 0
         self.dt = 0
         self.color_index = 0
@@ -125,6 +181,28 @@ class CreateLight(object):
         # If animation is lagging, increase self.timing e.g 33ms
         self.timing = 15
 
+        # Color gradient table shared with the other lights using the same colors
+        self.gradient_table = gradient_lut(self.start_color_gradient, self.end_color_gradient)
+
+        # Light kernel (None for the default CreateLight.KERNEL)
+        self.kernel = kernel_
+        # Light intensity folded into integer scales for the fixed-point kernel
+        # (volumetric effect is disabled for the mouse light, see spotlight)
+        self.fixed_point = fixed_point_scale(self.light_intensity, self.light_volume and not self.mouse)
+        self.fixed_point_flickering = fixed_point_scale(self.light_intensity)
+
+        # Premultiplied light coefficient and its animation state (see light_coefficient)
+        self.coefficient = None
+        self.coefficient_key = None
+        # Pre-allocated scratch and output arrays (see buffer)
+        self.buffers = {}
+        # Persistent light surfaces and their current mask alpha (see light_surface)
+        self.surfaces = {}
+
+    def light_kernel(self) -> str:
+        """ return the kernel used by this light ('float', 'fixed' or 'fused') """
+        return self.kernel if self.kernel is not None else CreateLight.KERNEL
+
     def gradient(self, index_: int)->list:
         """ create a color gradient
         :param index_: index pointing to a specific color from a color gradient array (linear color gradient)
@@ -136,18 +214,13 @@ class CreateLight(object):
         assert isinstance(index_, int), \
             'Expecting int for argument index_ got %s ' % type(index_)
 
-        diff_ = (array(self.end_color_gradient[:3]) - array(self.start_color_gradient[:3]))
-        row = arange(256, dtype='float') / 256
-        row = repeat(row[:, newaxis], [3], 1)
-        diff_ = repeat(diff_[newaxis, :], [256], 0)
-        row = numpy.add(array(self.start_color_gradient[:3], numpy.float), array((diff_ * row), dtype=numpy.float),
-                        dtype=numpy.float).astype(dtype=numpy.uint8)
-
-        return row[index_]
-
+        return self.gradient_table[index_]
 
-    def get_light_spot(self):
-        """ return numpy.arrays and sizes representing the area flood with light. """
+    def light_area(self):
+        """
+        return the area flood with light in screen coordinates and the matching area of the mask alpha
+        (pygame.Rect, pygame.Rect), both reshaped if the light is close to the screen border(s).
+        """
 
         # Light source position (x, y)
         x = self.position[0]
@@ -172,6 +245,14 @@ class CreateLight(object):
         elif y > SIZE[1] - ly:
             h_high = SIZE[1] - y
 
+        return pygame.Rect(x - w_low, y - h_low, w_low + w_high, h_low + h_high), \
+               pygame.Rect(lx - w_low, ly - h_low, w_low + w_high, h_low + h_high)
+
+    def get_light_spot(self):
+        """ return numpy.arrays and sizes representing the area flood with light. """
+
+        area, mask_area = self.light_area()
+
         if isinstance(self.alpha_mask, list):
             mask = self.alpha_mask[0]
         else:
@@ -186,10 +267,9 @@ class CreateLight(object):
         #       mask[lx - w_low:lx + w_high, ly - h_low:ly + h_high, :], \
         #       (w_low + w_high, h_low + h_high)
 
-        return RGB1[x - w_low:x + w_high, y - h_low:y + h_high, :], \
-               mask[lx - w_low:lx + w_high, ly - h_low:ly + h_high, :], \
-               (w_low + w_high, h_low + h_high)
-
+        return RGB1[area.left:area.right, area.top:area.bottom, :], \
+               mask[mask_area.left:mask_area.right, mask_area.top:mask_area.bottom, :], \
+               area.size
 
     def spotlight(self, rgb_array: numpy.array, alpha_array: pygame.Color, color_index_):
         """
@@ -208,6 +288,94 @@ class CreateLight(object):
         assert isinstance(color_index_, int), \
             'Expecting int for argument color_index_ got %s ' % type(color_index_)
         """
+        state = self.spotlight_state(alpha_array, color_index_)
+        if state is None:
+            return
+        kernel, color, rotation_frame, volume_frame, alpha_array, key = state
+
+        if kernel == FUSED_KERNEL and CreateLight.SURFACE_FORMAT != PREMULTIPLIED_FORMAT:
+            self.image = self.fused_surface(
+                'spotlight%s' % (self.counter % (CreateLight.PIPELINE_DEPTH + 1)), rgb_array, alpha_array, color,
+                self.V0[volume_frame] if volume_frame is not None else None)
+            if key is not None:
+                CreateLight.SURFACE_CACHE.put(key, self.image.copy())
+            return
+
+        coefficient = self.light_coefficient(kernel, alpha_array, color, rotation_frame, volume_frame)
+
+        # light resultant calculation (capped to 255)
+        w, h = rgb_array.shape[:2]
+        if kernel == FIXED_KERNEL:
+            new_array = shade_fixed(rgb_array, coefficient, self.fixed_point[1],
+                                    out=self.buffer('shade', (w, h, 3), numpy.uint32))
+        else:
+            new_array = shade_float(rgb_array, coefficient, out=self.buffer('shade', (w, h, 3), numpy.float64))
+
+        self.spotlight_surface(new_array, alpha_array, key)
+
+    def spotlight_state(self, alpha_array: numpy.ndarray, color_index_):
+        """
+        Return the spotlight animation state for the current frame, or None if the light surface is found
+        in the surface cache (self.image is then the cached surface).
+
+        :param alpha_array: numpy.ndarray representing the mask alpha (radial light intensity, check the mask type)
+        :param color_index_: Index for the color gradient.
+        :return: tuple (kernel, color, rotation frame, volume frame, mask alpha, cache key or None) or None
+        """
+        kernel = self.light_kernel()
+        color, rotation_frame, volume_frame, alpha_array = self.animation_state(alpha_array, color_index_)
+
+        # Surfaces of the animated lights are cached by animation state (the color includes the
+        # gradient index and the flickering state), the mouse light area is changing constantly.
+        cache = CreateLight.SURFACE_CACHE
+        key = None
+        if cache is not None and self.logic and not self.mouse:
+            key = (self._id, tuple(color), rotation_frame, volume_frame, kernel, CreateLight.SURFACE_FORMAT)
+            surface = cache.get(key)
+            if surface is not None:
+                self.image = surface
+                return None
+
+        return kernel, color, rotation_frame, volume_frame, alpha_array, key
+
+    def spotlight_surface(self, new_array: numpy.ndarray, alpha_array: numpy.ndarray, key_=None):
+        """
+        Write the spotlight result into the light surface (self.image) and cache the surface.
+
+        :param new_array: numpy.ndarray (w, h, 3) light result capped to 255
+        :param alpha_array: numpy.ndarray (w, h, 1) uint8 mask alpha
+        :param key_: surface cache key returned by spotlight_state or None
+        """
+        # Write the result into the light surface (RGBA model), the surfaces of the frames in flight
+        # are not overwritten (pipelined rendering)
+        self.image = self.light_surface('spotlight%s' % (self.counter % (CreateLight.PIPELINE_DEPTH + 1)),
+                                        new_array, alpha_array)
+        if key_ is not None:
+            # the light surface is re-used by the next frame
+            CreateLight.SURFACE_CACHE.put(key_, self.image.copy())
+
+    def update_coefficient(self, alpha_array: numpy.ndarray, color_index_):
+        """
+        Update the light coefficient for the current animation state (color variance, flickering, rotating light,
+        volume) without shading the light (see spotlight and Compositor.LightMap).
+
+        :param alpha_array: numpy.ndarray representing the mask alpha (radial light intensity, check the mask type)
+        :param color_index_: Index for the color gradient.
+        :return: tuple (kernel, coefficient, mask alpha used for this frame)
+        """
+        kernel = self.light_kernel()
+        color, rotation_frame, volume_frame, alpha_array = self.animation_state(alpha_array, color_index_)
+        return kernel, self.light_coefficient(kernel, alpha_array, color, rotation_frame, volume_frame), alpha_array
+
+    def animation_state(self, alpha_array: numpy.ndarray, color_index_):
+        """
+        Return the light animation state for the current frame (color variance, flickering, rotating light,
+        volume).
+
+        :param alpha_array: numpy.ndarray representing the mask alpha (radial light intensity, check the mask type)
+        :param color_index_: Index for the color gradient.
+        :return: tuple (color, rotation frame or None, volume frame or None, mask alpha used for this frame)
+        """
         color = self.light_shade[:3]
 
         # progressive color change from two distinct colors (see Constants.py e.g LIGHT definition.)
@@ -220,9 +388,13 @@ class CreateLight(object):
                 color = [color[0] >> 1, color[1] >> 1, color[2] >> 1]
 
         # Rotate the light with pre-calculated masks alpha.
+        rotation_frame = None
         if self.light_rotating:
             if isinstance(self.alpha_mask, list):
-                alpha_array = self.alpha_mask[self.counter % (len(self.alpha_mask) - 1)]
+                rotation_frame = self.counter % (len(self.alpha_mask) - 1)
+                mask_area = self.light_area()[1]
+                alpha_array = self.alpha_mask[rotation_frame][
+                              mask_area.left:mask_area.right, mask_area.top:mask_area.bottom, :]
 
         # Add texture to the light for volumetric aspect.
         # The texture is loaded in the main loop and played sequentially (self.counter)
@@ -231,26 +403,41 @@ class CreateLight(object):
         # alpha_array and rgb_array will not match the array shape of the texture define by self.volume.
         # In short, the volumetric effect will be disable for dynamic light using the mouse position.
         # todo pixels3d / array3d choose the best format according to surface
-        if self.logic1:
-            volume_array = numpy.divide(self.V0[self.counter % len(self.volume)], 25)
-            args = alpha_array * self.light_intensity * color * volume_array
-        else:
-            args = alpha_array * self.light_intensity * color
+        volume_frame = self.counter % len(self.volume) if self.logic1 else None
 
-        # light resultant calculation
-        new_array = numpy.multiply(rgb_array, args) #.astype(numpy.uint16)
+        return color, rotation_frame, volume_frame, alpha_array
 
-        # Cap the array
-        putmask(new_array, new_array > 255, 255)
-        # putmask(new_array, new_array < 0, 0)
+    def light_coefficient(self, kernel_: str, alpha_array: numpy.ndarray, color, rotation_frame_, volume_frame_):
+        """
+        Return the premultiplied light coefficient (mask * intensity * color [* volume]).
 
-        # Build a 3d array (model RGB + A)
-        new = numpy.dstack((new_array, alpha_array))
+        The coefficient is cached and rebuilt only when the light animation state changes
+        (color, rotation frame or volume frame), otherwise the cached array is returned as is.
 
-        # Build the pygame surface (RGBA model)
-        self.image = pygame.image.frombuffer(new.transpose(1, 0, 2).copy('C').astype(numpy.uint8),
-                                       (new.shape[:2][0], new.shape[:2][1]), 'RGBA')
+        :param kernel_: light kernel 'float' or 'fixed'
+        :param alpha_array: numpy.ndarray representing the mask alpha
+        :param color: light color (R, G, B)
+        :param rotation_frame_: index of the rotating mask alpha or None
+        :param volume_frame_: index of the volumetric texture or None
+        """
+        # The mouse light is clipped differently according to its position
+        key = (kernel_, tuple(color), rotation_frame_, volume_frame_, self.position if self.mouse else None)
+
+        if key != self.coefficient_key:
+            volume_array = self.V0[volume_frame_] if volume_frame_ is not None else None
+            shape = (*alpha_array.shape[:2], 3)
+            if kernel_ == FIXED_KERNEL:
+                self.coefficient = light_coefficient_fixed(
+                    alpha_array, self.fixed_point, color, volume_array,
+                    out=self.buffer('coefficient', shape, numpy.uint32))
+            else:
+                self.coefficient = light_coefficient_float(
+                    alpha_array, self.light_intensity, color, volume_array,
+                    out=self.buffer('coefficient', shape, numpy.float64),
+                    scratch=self.buffer('shade', shape, numpy.float64) if volume_array is not None else None)
+            self.coefficient_key = key
 
+        return self.coefficient
 
     def flickering(self, rgb_array, alpha_array):
         assert isinstance(rgb_array, numpy.ndarray), \
@@ -259,13 +446,140 @@ class CreateLight(object):
             'Expecting numpy.ndarray for argument alpha_array got %s ' % type(alpha_array)
 
         color = [self.light_shade[0] >> 1, self.light_shade[1] >> 1, self.light_shade[2] >> 1 ]
-        new_array = numpy.multiply(rgb_array, alpha_array * self.light_intensity * color,
-                                   dtype=numpy.float)
-        putmask(new_array, new_array > 255, 255)
-        # putmask(new_array, new_array < 0, 0)
-        new = numpy.dstack((new_array, alpha_array))
-        return pygame.image.frombuffer(new.transpose(1, 0, 2).copy('C').astype(numpy.uint8),
-                                       (new.shape[:2][0], new.shape[:2][1]), 'RGBA')
+        w, h = rgb_array.shape[:2]
+        if self.light_kernel() == FUSED_KERNEL and CreateLight.SURFACE_FORMAT != PREMULTIPLIED_FORMAT:
+            return self.fused_surface('flickering', rgb_array, alpha_array, color)
+        if self.light_kernel() == FIXED_KERNEL:
+            coefficient = light_coefficient_fixed(
+                alpha_array, self.fixed_point_flickering, color,
+                out=self.buffer('flickering_coefficient', (w, h, 3), numpy.uint32))
+            new_array = shade_fixed(rgb_array, coefficient, self.fixed_point_flickering[1], out=coefficient)
+        else:
+            coefficient = light_coefficient_float(
+                alpha_array, self.light_intensity, color,
+                out=self.buffer('flickering_coefficient', (w, h, 3), numpy.float64))
+            new_array = shade_float(rgb_array, coefficient, out=coefficient)
+        return self.light_surface('flickering', new_array, alpha_array)
+
+    def light_surface(self, name_: str, new_array: numpy.ndarray, alpha_array: numpy.ndarray) -> pygame.Surface:
+        """
+        Write the light result and its mask alpha directly into the persistent SRCALPHA surface <name_>
+        (pixels3d / pixels_alpha views). The surface is created once and re-used every frame
+        (re-created only if the light area is clipped differently, e.g the mouse light).
+
+        :param name_: surface name
+        :param new_array: numpy.ndarray (w, h, 3) light result capped to 255
+        :param alpha_array: numpy.ndarray (w, h, 1) uint8 mask alpha
+        :return: pygame.Surface
+        """
+        size = new_array.shape[:2]
+        surface_format = CreateLight.SURFACE_FORMAT
+        surface, alpha, format_ = self.surfaces.get(name_, (None, None, None))
+        if surface is None or surface.get_size() != size or format_ != surface_format:
+            surface, alpha = self.new_surface(size), None
+
+        if surface_format == PREMULTIPLIED_FORMAT:
+            # new_array is a scratch array and can be modified in place
+            numpy.multiply(new_array, alpha_array, out=new_array)
+            if new_array.dtype == numpy.float64:
+                numpy.divide(new_array, 255, out=new_array)
+            else:
+                numpy.floor_divide(new_array, 255, out=new_array)
+
+        # the views are locking the surface and must be released before blitting
+        rgb = pygame.surfarray.pixels3d(surface)
+        numpy.copyto(rgb, new_array, casting='unsafe')
+        del rgb
+
+        # the mask alpha only changes with the rotating and mouse lights
+        if alpha_array is not alpha:
+            alpha = pygame.surfarray.pixels_alpha(surface)
+            numpy.copyto(alpha, alpha_array[:, :, 0])
+            del alpha
+
+        self.surfaces[name_] = (surface, alpha_array, surface_format)
+        return surface
+
+    def fused_surface(self, name_: str, rgb_array: numpy.ndarray, alpha_array: numpy.ndarray, color,
+                      volume_array: numpy.ndarray = None) -> pygame.Surface:
+        """
+        Shade the light in a single pass with the light kernel of the compute backend (kernel 'fused',
+        see Backends.py) straight into the persistent light surface <name_> (see light_surface).
+        The premultiplied surface format is not supported (float kernel used instead).
+
+        :param name_: surface name
+        :param rgb_array: numpy.ndarray (w, h, 3) uint8 representing the area flood with light
+        :param alpha_array: numpy.ndarray (w, h, 1) uint8 mask alpha
+        :param color: light color (R, G, B)
+        :param volume_array: numpy.ndarray (w, h, 3) uint8 volumetric texture or None
+        :return: pygame.Surface
+        """
+        size = rgb_array.shape[:2]
+        surface_format = CreateLight.SURFACE_FORMAT
+        surface, _, format_ = self.surfaces.get(name_, (None, None, None))
+        if surface is None or surface.get_size() != size or format_ != surface_format:
+            surface = self.new_surface(size)
+
+        # the views are locking the surface and must be released before blitting
+        rgb = pygame.surfarray.pixels3d(surface)
+        alpha = pygame.surfarray.pixels_alpha(surface)
+        get_backend().light_kernel(rgb_array, alpha_array, self.light_intensity,
+                                   int(color[0]), int(color[1]), int(color[2]), rgb, alpha, volume_array)
+        del rgb, alpha
+
+        self.surfaces[name_] = (surface, alpha_array, surface_format)
+        return surface
+
+    @staticmethod
+    def new_surface(size_: tuple) -> pygame.Surface:
+        """ Return a new light surface with the pixel format selected by CreateLight.SURFACE_FORMAT """
+        assert CreateLight.SURFACE_FORMAT in SURFACE_FORMATS, \
+            'Expecting %s for CreateLight.SURFACE_FORMAT got %s ' % (SURFACE_FORMATS, CreateLight.SURFACE_FORMAT)
+
+        surface = pygame.Surface(size_, pygame.SRCALPHA, 32)
+        if CreateLight.SURFACE_FORMAT is not None:
+            surface = surface.convert_alpha()
+        return surface
+
+    @staticmethod
+    def draw(lights_, surface_: pygame.Surface):
+        """
+        Draw the lights onto surface_ with the blending mode matching CreateLight.SURFACE_FORMAT
+
+        :param lights_: sprite group or list of lights to draw (in order)
+        :param surface_: pygame.Surface
+        """
+        flags = pygame.BLEND_PREMULTIPLIED if CreateLight.SURFACE_FORMAT == PREMULTIPLIED_FORMAT else 0
+        surface_.blits([(light.image, light.rect, None, flags) for light in lights_], doreturn=False)
+
+    def is_static(self) -> bool:
+        """ True if the light never changes (no variance, rotation, volume, flickering and not the mouse light) """
+        return not (self.light_variance or self.light_rotating or self.light_volume or
+                    self.light_flickering or self.mouse)
+
+    def is_moving(self) -> bool:
+        """ True if the light follows the mouse position (light area changing every frame) """
+        return self.mouse
+
+    def static_signature(self) -> tuple:
+        """ return the properties a static light result depends on (see Compositor.StaticLayer) """
+        return (self.position, self.light_shape, tuple(self.light_shade), self.light_intensity,
+                self.light_kernel(), CreateLight.SURFACE_FORMAT)
+
+    def buffer(self, name_: str, shape_: tuple, dtype_) -> numpy.ndarray:
+        """
+        Return the light scratch/output array <name_>, allocated once and re-used every frame
+        (re-allocated only if the light area is clipped differently, e.g the mouse light).
+
+        :param name_: buffer name
+        :param shape_: array shape
+        :param dtype_: array data type
+        """
+        array_ = self.buffers.get(name_)
+        if array_ is None or array_.shape != shape_ or array_.dtype != dtype_:
+            array_ = numpy.empty(shape_, dtype=dtype_)
+            self.buffers[name_] = array_
+        return array_
 
     def offset_calculation(self):
         if self.image.get_size() != self.light_shape:
@@ -282,7 +596,9 @@ class ShowLight(pygame.sprite.Sprite, CreateLight):
 
     def __init__(self, light_settings):
 
-        pygame.sprite.Sprite.__init__(self, self.containers)
+        # the light is added to the groups once initialised (lights can be created by a
+        # threading.Timer while the groups are updated)
+        pygame.sprite.Sprite.__init__(self)
         CreateLight.__init__(self, *light_settings)
 
         assert isinstance(SCREENRECT, pygame.Rect), \
@@ -325,6 +641,167 @@ class ShowLight(pygame.sprite.Sprite, CreateLight):
 
         self.factor = 1
 
+        # Baked animation cycle and the light settings used for baking (see bake)
+        self.frames = None
+        self.frames_key = None
+        # True when the light has been shaded for the next update by shade_batch
+        self.batched = False
+        if not self.mouse and CreateLight.BAKE_BUDGET > 0:
+            self.bake(CreateLight.BAKE_BUDGET)
+
+        self.add(self.containers)
+
+    def period(self):
+        """
+        return the animation period of the light (number of updates), LCM of the color variance (ping-pong),
+        rotation and volume periods. None if the light is not periodic (mouse light or random flickering
+        applied to an animated light).
+        """
+        if self.mouse or (self.light_flickering and not self.light_variance and self.logic):
+            return None
+
+        periods = []
+        if self.light_variance:
+            periods.append(len(GRADIENT_PING_PONG))
+        if self.light_rotating and isinstance(self.alpha_mask, list):
+            periods.append(len(self.alpha_mask) - 1)
+        if self.logic1:
+            periods.append(len(self.volume))
+        return reduce(lambda a, b: a * b // math.gcd(a, b), periods, 1)
+
+    def bake(self, budget_: int) -> bool:
+        """
+        Pre-render the light surfaces for one full animation period, the animation is then played back
+        from the baked frames (list index).
+        Nothing is baked if the frames are exceeding the memory budget, the light is then computed live.
+
+        :param budget_: int; memory budget in bytes
+        :return: True if the light animation has been baked
+        """
+        self.frames = None
+        period = self.period()
+        if not self.logic or period is None:
+            return False
+
+        w, h = self.chunk.shape[:2]
+        if period * w * h * 4 > budget_:
+            print('[-] %s not baked, %s frames exceeding the memory budget' % (self.light_name, period))
+            return False
+
+        counter = self.counter
+        frames = []
+        for self.counter in range(period):
+            # the color index is following the ping-pong sequence with the light counter
+            self.spotlight(self.chunk, self.alpha,
+                           int(GRADIENT_PING_PONG[self.counter % len(GRADIENT_PING_PONG)]))
+            frames.append(self.image.copy())
+
+        self.counter = counter
+        self.frames = frames
+        self.frames_key = (CreateLight.SURFACE_FORMAT, self.light_kernel())
+        self.image = self.frames[self.counter % period]
+        return True
+
+    def playback(self) -> bool:
+        """ True if the light animation is played back from the baked frames (still matching the light settings) """
+        return self.frames is not None and not CreateLight.LIGHTMAP and \
+            self.frames_key == (CreateLight.SURFACE_FORMAT, self.light_kernel())
+
+    def batchable(self) -> bool:
+        """ True if the light is due to be shaded by the float kernel for the next update (see shade_batch) """
+        return self.dt > self.timing and self.logic and not self.mouse and not CreateLight.LIGHTMAP and \
+            self.light_kernel() == FLOAT_KERNEL and not self.playback()
+
+    @staticmethod
+    def shade_batch(lights_):
+        """
+        Shade the lights for their next update, the lights with the same area shape (and volumetric effect)
+        are stacked into 4d arrays (chunks, masks alpha, volumes) and shaded together with a single call per
+        array operation (see LightKernels.spotlight_batch_float), the python and ufunc dispatch overhead is paid
+        once per group instead of once per light. The next update of each light is then only advancing its
+        animation.
+
+        :param lights_: list of lights returned True by batchable
+        """
+        groups = {}
+        for light in lights_:
+            state = light.spotlight_state(light.alpha, light.color_index)
+            light.batched = True
+            if state is None:
+                # surface cache hit
+                continue
+            volume_frame = state[3]
+            groups.setdefault((light.chunk.shape, volume_frame is not None), []).append((light, state))
+
+        for (shape, volume), group in groups.items():
+            if len(group) == 1:
+                light, (kernel, color, rotation_frame, volume_frame, alpha_array, key) = group[0]
+                coefficient = light.light_coefficient(kernel, alpha_array, color, rotation_frame, volume_frame)
+                new_array = shade_float(light.chunk, coefficient,
+                                        out=light.buffer('shade', (*shape[:2], 3), numpy.float64))
+                light.spotlight_surface(new_array, alpha_array, key)
+                continue
+
+            # the chunks (areas flood with light) are static, they are stacked again only when a light
+            # joins or leaves the group or when its area is re-calculated (see refresh)
+            chunks = [light.chunk for light, _ in group]
+            stacked_chunks, stacked = CreateLight.BATCH_CHUNKS.get((shape, volume), ((), None))
+            if len(stacked_chunks) != len(chunks) or \
+                    any(chunk is not stacked_chunk for chunk, stacked_chunk in zip(chunks, stacked_chunks)):
+                stacked = numpy.stack(chunks)
+                CreateLight.BATCH_CHUNKS[(shape, volume)] = (chunks, stacked)
+
+            new_arrays = spotlight_batch_float(
+                stacked,
+                numpy.stack([state[4] for _, state in group]),
+                [light.light_intensity for light, _ in group],
+                [state[1][:3] for _, state in group],
+                numpy.stack([light.V0[state[3]] for light, state in group]) if volume else None)
+
+            for (light, state), new_array in zip(group, new_arrays):
+                light.spotlight_surface(new_array, state[4], state[5])
+
+    def render(self, rgb_array: numpy.ndarray, alpha_array: numpy.ndarray):
+        """
+        Shade the light for the current frame, or only update its light coefficient when the lights
+        are composited into a light map (CreateLight.LIGHTMAP).
+        """
+        if CreateLight.LIGHTMAP:
+            self.update_coefficient(alpha_array, self.color_index)
+        else:
+            self.spotlight(rgb_array, alpha_array, self.color_index)
+
+    def kill(self):
+        """ Remove the light from all the groups and drop its surfaces from the surface cache """
+        if CreateLight.SURFACE_CACHE is not None:
+            CreateLight.SURFACE_CACHE.discard(self._id)
+        pygame.sprite.Sprite.kill(self)
+
+    def refresh(self):
+        """
+        Re-build the light after a change of its properties (position, shade, intensity, kernel or
+        surface format).
+        """
+        self.fixed_point = fixed_point_scale(self.light_intensity, self.logic1)
+        self.fixed_point_flickering = fixed_point_scale(self.light_intensity)
+        self.coefficient_key = None
+        if CreateLight.SURFACE_CACHE is not None:
+            CreateLight.SURFACE_CACHE.discard(self._id)
+
+        self.chunk, self.alpha, _ = self.get_light_spot()
+        self.render(self.chunk, self.alpha)
+        if not CreateLight.LIGHTMAP:
+            self.image_copy = self.image.copy()
+            if self.light_flickering:
+                self.image_flickering = self.flickering(self.chunk, self.alpha)
+
+            self.offset = pygame.math.Vector2(0, 0)
+            self.offset_calculation()
+            self.rect = self.image.get_rect(center=self.position + self.offset / 2)
+
+        if self.frames is not None:
+            self.bake(CreateLight.BAKE_BUDGET)
+
     def update(self):
 
         if self.dt > self.timing:
@@ -333,7 +810,7 @@ class ShowLight(pygame.sprite.Sprite, CreateLight):
             # and thus the area re-calculated every frames with 'self.spotlight'
             if self.mouse:
                 self.position = MOUSE_POS
-                self.spotlight(*self.get_light_spot()[:2], self.color_index)
+                self.render(*self.get_light_spot()[:2])
                 self.offset.x, self.offset.y = (0, 0)
                 self.offset_calculation()
                 self.rect = self.image.get_rect(center=self.position + self.offset / 2)
@@ -344,10 +821,18 @@ class ShowLight(pygame.sprite.Sprite, CreateLight):
                 # following effects require a constant re-calculation of the light flooded area.
                 # self.logic = self.light_variance or self.light_rotating or self.light_volume
                 if self.logic:
-                    self.spotlight(self.chunk, self.alpha, self.color_index)
+                    if self.playback():
+                        self.image = self.frames[self.counter % len(self.frames)]
+                    elif self.batched:
+                        # already shaded for this frame (see shade_batch)
+                        self.batched = False
+                    else:
+                        self.render(self.chunk, self.alpha)
 
                 elif self.light_flickering:
-                    if random.randint(0, 1000) > 950:
+                    if CreateLight.LIGHTMAP:
+                        self.update_coefficient(self.alpha, self.color_index)
+                    elif random.randint(0, 1000) > 950:
                         self.image = self.image_flickering
                     else:
                         self.image = self.image_copy
@@ -364,6 +849,35 @@ class ShowLight(pygame.sprite.Sprite, CreateLight):
 
         self.dt += TIME_PASSED_SECONDS
 
+    @staticmethod
+    def update_lights(lights_, executor_: ThreadPoolExecutor = None):
+        """
+        Update all the lights, the lights due for a new frame are computed concurrently by the thread pool
+        (the numpy kernels are releasing the GIL). Each light only writes into its own buffers and surfaces,
+        the finished surfaces (light.image) are drawn afterward by the main thread in the group order.
+
+        :param lights_: sprite group or list of lights
+        :param executor_: ThreadPoolExecutor or None to update the lights serially
+        """
+        if CreateLight.BATCH:
+            ShowLight.shade_batch([light for light in lights_ if light.batchable()])
+
+        if executor_ is None:
+            for light in lights_:
+                light.update()
+            return
+
+        futures = []
+        for light in lights_:
+            if light.dt > light.timing:
+                futures.append(executor_.submit(light.update))
+            else:
+                light.update()
+
+        # wait for all the lights (re-raise the worker exceptions)
+        for future in futures:
+            future.result()
+
 
 if __name__ == '__main__':
 
@@ -372,6 +886,9 @@ if __name__ == '__main__':
     SCREEN.blit(TEXTURE1, (0, 0))
     pygame.display.flip()
 
+    if CreateLight.SURFACE_CACHE_BUDGET > 0:
+        CreateLight.SURFACE_CACHE = SurfaceCache(CreateLight.SURFACE_CACHE_BUDGET)
+
     LIGHT_GROUP = pygame.sprite.Group()
     All = pygame.sprite.RenderUpdates()
     ShowLight.containers = LIGHT_GROUP, All
@@ -400,6 +917,33 @@ if __name__ == '__main__':
                Shadow(ALL_SEGMENTS, static_=True, location_=(333, 595))                    # LIGHT5
                ]
 
+    # Thread pool computing the lights concurrently (CreateLight.THREADS)
+    executor = ThreadPoolExecutor(max_workers=CreateLight.THREADS) if CreateLight.THREADS > 0 else None
+
+    # Light map compositor (CreateLight.LIGHTMAP), the background texture is lit by the ambient light only
+    # (TEXTURE1 alpha) and every light is added on top.
+    lightmap = None
+    if CreateLight.LIGHTMAP:
+        lightmap = TiledLightMap(RGB1, TEXTURE1.get_alpha() / 255, executor) if CreateLight.TILED \
+            else LightMap(RGB1, TEXTURE1.get_alpha() / 255)
+    # Sprite renderer, with CreateLight.LAYERED the static lights are baked once into a base layer when
+    # the drawing order allows it, the other lights and the shadows are drawn every frame.
+    renderer = LayeredRenderer(TEXTURE1, shadows, CreateLight.draw) if CreateLight.LAYERED \
+        else SpriteRenderer(TEXTURE1, shadows, CreateLight.draw)
+
+    def compute_frame(mouse_position_):
+        """ Update the lights and project the dynamic shadows, return the frame to present or None """
+        ShowLight.update_lights(All, executor)
+        if not CreateLight.UPDATE:
+            return None
+        CreateLight.UPDATE = False
+        return [LightFrame(light) for light in All], renderer.update_shadows(mouse_position_)
+
+    # Pipelined rendering (CreateLight.PIPELINE_DEPTH, sprite renderer only), the next frames are computed
+    # in a background thread while the current frame is composited and presented.
+    pipeline = FramePipeline(compute_frame, CreateLight.PIPELINE_DEPTH) \
+        if CreateLight.PIPELINE_DEPTH > 0 and lightmap is None else None
+
     clock = pygame.time.Clock()
     global UPDATE
     UPDATE = False
@@ -432,17 +976,25 @@ if __name__ == '__main__':
                 PAUSE = True
                 print('Paused')
 
-        All.update()
+        if pipeline is not None:
+            frame = pipeline.next(MOUSE_POS)
+            if frame is not None:
+                renderer.compose(frame[0], SCREEN, frame[1])
+                pygame.display.flip()
 
-        if CreateLight.UPDATE:
+        else:
+            ShowLight.update_lights(All, executor)
+
+        if pipeline is None and CreateLight.UPDATE:
 
-            SCREEN.fill((0, 0, 0, 255))
-            SCREEN.blit(TEXTURE1, (0, 0))
-            All.draw(SCREEN)
+            if lightmap is not None:
+                lightmap.draw(All, SCREEN)
+                for shadow in shadows:
+                    shadow.update(MOUSE_POS)
+                    shadow.render_frame()
+            else:
+                renderer.draw(All, SCREEN, MOUSE_POS)
             CreateLight.UPDATE = False
-            for shadow in shadows:
-                shadow.update(MOUSE_POS)
-                shadow.render_frame()
 
             pygame.display.flip()
 
@@ -451,4 +1003,8 @@ if __name__ == '__main__':
 
         FRAME += 1
 
+    if pipeline is not None:
+        pipeline.shutdown()
+    if executor is not None:
+        executor.shutdown()
     pygame.quit()
@@ -69,14 +69,22 @@ __email__ = "yoyoberenguer@hotmail.com"
 __status__ = "Demo"
 
 import numpy
-from numpy import putmask, array, arange, repeat, newaxis
+from numpy import putmask, newaxis
 import random
 import threading
 from Constants import *
 from Shadows import Shadow
+from LightKernels import gradient_lut, VOLUME_DIVISOR
+from Backends import get_backend
+from SharedTextures import SharedTextures, attach, detach
+from Pipeline import FramePipeline, LightFrame
 import time
 import multiprocessing
 
+# LightCalc requests
+CALC_REGISTER = 0
+CALC_FRAME = 1
+CALC_STOP = 2
 
 
 class LightSpot(multiprocessing.Process):
@@ -93,11 +101,14 @@ class LightSpot(multiprocessing.Process):
         while not self.event.is_set():
 
             if self.Q_in is not None:
+                # The textures are shared with the workers (see SharedTextures), only the light
+                # areas are sent back (tuples of slices)
+                # (position, light shape) or (CALC_STOP,) sent at shutdown
                 queue = self.Q_in.get()
+                if queue[0] == CALC_STOP:
+                    break
                 position = queue[0]
                 light_shape = queue[1]
-                alpha_mask = queue[2]
-                RGB1 = queue[3]
 
                 # Light source position (x, y)
                 x = position[0]
@@ -114,23 +125,18 @@ class LightSpot(multiprocessing.Process):
                 # Reshaping if close to the border(s).
                 if x < lx:
                     w_low = x
-                elif x > 1280 - lx:
-                    w_high = 1280 - x
+                elif x > SIZE[0] - lx:
+                    w_high = SIZE[0] - x
 
                 if y < ly:
                     h_low = y
-                elif y > 1024 - ly:
-                    h_high = 1024 - y
+                elif y > SIZE[1] - ly:
+                    h_high = SIZE[1] - y
 
-                if isinstance(alpha_mask, list):
-                    mask = alpha_mask[0]
-                else:
-                    mask = alpha_mask
-
-                self.Q_out.put((RGB1[x - w_low:x + w_high, y - h_low:y + h_high, :],
-                        mask[lx - w_low:lx + w_high, ly - h_low:ly + h_high, :],
-                        (w_low + w_high, h_low + h_high))
-                       )
+                self.Q_out.put(((slice(x - w_low, x + w_high), slice(y - h_low, y + h_high)),
+                                (slice(lx - w_low, lx + w_high), slice(ly - h_low, ly + h_high)),
+                                (w_low + w_high, h_low + h_high))
+                               )
             else:
                 time.sleep(0.01)
 
@@ -146,99 +152,207 @@ class LightCalc(multiprocessing.Process):
         self.Q_out = q_out
         self.event = event_
         self.stop = False
+        # Lights registered with this worker {light id: light settings}
+        self.lights = {}
 
     def gradient(self, index_: int, start_color_gradient, end_color_gradient):
         """ create a color gradient """
         assert isinstance(index_, int), \
             'Expecting int for argument index_ got %s ' % type(index_)
 
-        value = 256
-        diff_ = (array(end_color_gradient[:3]) - array(start_color_gradient[:3]))
-        row = arange(value, dtype='float') / value
-        row = repeat(row[:, newaxis], [3], 1)
-        diff_ = repeat(diff_[newaxis, :], [value], 0)
-        row = numpy.add(array(start_color_gradient[:3], numpy.float), array((diff_ * row), numpy.float),
-                        dtype=numpy.float).astype(dtype=numpy.uint8)
-        return row[index_]
+        return gradient_lut(start_color_gradient, end_color_gradient)[index_]
+
+    def register(self, settings_: tuple) -> tuple:
+        """
+        Attach the light textures (shared memory) and return the light settings used by shade.
+
+        :param settings_: tuple sent by CreateLight.register
+        :return: tuple light settings with the area flood with light and the masks alpha
+        """
+        (light_shade, light_variance, start_color_gradient, end_color_gradient, light_flickering,
+         light_rotating, mask_texture, light_volume, mouse, volume_texture, light_intensity,
+         (texture, rgb_area), mask_area) = settings_
+
+        # masks alpha, volumetric textures and background texture are attached from
+        # the shared memory (descriptors, see SharedTextures)
+        alpha_mask = attach(mask_texture)
+        volume = attach(volume_texture) if volume_texture is not None else None
+        rgb_array = attach(texture)[rgb_area]
+
+        return (light_shade, light_variance, start_color_gradient, end_color_gradient, light_flickering,
+                light_rotating, alpha_mask, light_volume, mouse, volume, light_intensity, rgb_array, mask_area)
+
+    def shade(self, light_, color_index_: int, counter: int) -> numpy.ndarray:
+        """
+        Calculate the light for one frame.
+
+        :param light_: tuple light settings returned by register
+        :param color_index_: Index for the color gradient.
+        :param counter: light frame number
+        :return: numpy.ndarray (w, h, 4) uint8 RGBA light
+        """
+        (light_shade, light_variance, start_color_gradient, end_color_gradient, light_flickering,
+         light_rotating, alpha_mask, light_volume, mouse, volume, light_intensity, rgb_array, mask_area) = light_
+        alpha_array = alpha_mask[0][mask_area]
+        volume_array = None
+
+        color = light_shade[:3]
+
+        # progressive color change from two distinct colors (see Constants.py e.g LIGHT definition.)
+        if light_variance:
+            color = self.gradient(color_index_, start_color_gradient, end_color_gradient)
+
+        # self explanatory
+        elif light_flickering:
+            if random.randint(0, 1000) > 950:
+                color = [color[0] >> 1, color[1] >> 1, color[2] >> 1]
+
+        # Rotate the light with pre-calculated masks alpha.
+        if light_rotating:
+            if len(alpha_mask) > 1:
+                alpha_array = alpha_mask[counter % (len(alpha_mask) - 1)][mask_area]
+
+        # Add texture to the light for volumetric aspect.
+        # The texture is loaded in the main loop and played sequentially (self.counter)
+        # (and not self.mouse) --> if the mouse goes outside of the main window, the shape of
+        # alpha_array and rgb_array will not match the array shape of the texture define by self.volume.
+        # In short, the volumetric effect will be disable for dynamic light using the mouse position.
+        elif light_volume and not mouse:
+            volume_array = volume[counter % len(volume)]
+
+        # same light kernel than LightDemo (see Backends.py), the light and the mask alpha are
+        # written into the RGBA array sent back to the main process
+        new = numpy.empty((*alpha_array.shape[:2], 4), dtype=numpy.uint8)
+        get_backend().light_kernel(rgb_array, alpha_array, light_intensity,
+                                   int(color[0]), int(color[1]), int(color[2]),
+                                   new[:, :, :3], new[:, :, 3], volume_array)
+        return new
 
     def run(self):
-        while not self.event.is_set():
+        try:
+            while not self.event.is_set():
 
-            if self.Q_in is not None:
+                if self.Q_in is not None:
 
-                queue = self.Q_in.get()
-                light_shade = queue[0]
-                light_variance = queue[1]
-                color_index_ = queue[2]
-                start_color_gradient = queue[3]
-                end_color_gradient = queue[4]
-
-                light_flickering = queue[5]
-                light_rotating = queue[6]
-                alpha_mask = queue[7]
-                counter = queue[8]
-                light_volume = queue[9]
-                mouse = queue[10]
-                volume = queue[11]
-                light_intensity = queue[12]
-                rgb_array = queue[13]
-                alpha_array = queue[14]
-
-
-                color = light_shade[:3]
-
-                # progressive color change from two distinct colors (see Constants.py e.g LIGHT definition.)
-                if light_variance:
-                    color = self.gradient(color_index_, start_color_gradient, end_color_gradient)
-
-                # self explanatory
-                elif light_flickering:
-                    if random.randint(0, 1000) > 950:
-                        color = [color[0] >> 1, color[1] >> 1, color[2] >> 1]
-
-                # Rotate the light with pre-calculated masks alpha.
-                if light_rotating:
-                    if isinstance(alpha_mask, list):
-                        alpha_array = alpha_mask[counter % (len(alpha_mask) - 1)]
-
-                # Add texture to the light for volumetric aspect.
-                # The texture is loaded in the main loop and played sequentially (self.counter)
-                # (and not self.mouse) --> if the mouse goes outside of the main window, the shape of
-                # alpha_array and rgb_array will not match the array shape of the texture define by self.volume.
-                # In short, the volumetric effect will be disable for dynamic light using the mouse position.
-                # todo pixels3d / array3d choose the best format according to surface
-                elif light_volume and not mouse:
-                    volume_array = volume[counter % len(volume)] >> 5
-
-                # todo  alpha_array * self.light_intensity * color * volume_array
-                # UnboundLocalError: local variable 'volume_array' referenced before assignment
-                # default arguments
-                # args = alpha_array * self.light_intensity * color if not self.light_volume else\
-                #    alpha_array * self.light_intensity * color * volume_array
-                if light_volume:
-                    m = volume_array * light_intensity * color
-                    args = numpy.multiply(alpha_array, m)
+                    # (CALC_REGISTER, light id, light settings) sent once per light then
+                    # (CALC_FRAME, light id, color index, frame number) for every frame
+                    queue = self.Q_in.get()
+                    if queue[0] == CALC_REGISTER:
+                        self.lights[queue[1]] = self.register(queue[2])
+
+                    elif queue[0] == CALC_FRAME:
+                        light_id, color_index_, counter = queue[1:]
+                        # the reply carries the light id and frame number (see Replies)
+                        self.Q_out.put((light_id, counter, self.shade(self.lights[light_id], color_index_, counter)))
+
+                    elif queue[0] == CALC_STOP:
+                        break
                 else:
-                    args = alpha_array * light_intensity * color
+                    time.sleep(0.001)
+        finally:
+            # release the views before closing the shared memory blocks
+            self.lights.clear()
+            detach()
 
-                # light resultant calculation
-                new_array = numpy.multiply(rgb_array, args).astype(numpy.uint16)
+        print('LightSpot %s is dead.')
 
-                # Cap the the array
-                putmask(new_array, new_array > 255, 255)
-                # putmask(new_array, new_array < 0, 0)
 
-                self.Q_out.put(numpy.dstack((new_array, alpha_array)))
-            else:
-                time.sleep(0.001)
+class Replies:
+    """ Dispatch the LightCalc replies to the lights, replies are matched with (light id, frame number). """
 
-        print('LightSpot %s is dead.')
+    def __init__(self, queue_):
+        self.queue = queue_
+        # replies received for other lights or frames {(light id, frame number): array}
+        self.pending = {}
+        # the lights can be created from other threads (e.g threading.Timer)
+        self.lock = threading.Lock()
+
+    def get(self, light_id_: int, frame_: int) -> numpy.ndarray:
+        """
+        Return the light calculated for (light id, frame number), wait for the reply if necessary.
+
+        :param light_id_: light id (CreateLight._id)
+        :param frame_: light frame number (CreateLight.counter)
+        :return: numpy.ndarray (w, h, 4) uint8 RGBA light
+        """
+        key = (light_id_, frame_)
+        with self.lock:
+            while key not in self.pending:
+                light_id, frame, array_ = self.queue.get()
+                self.pending[(light_id, frame)] = array_
+            return self.pending.pop(key)
+
+
+class LightPool:
+    """
+    Pool of LightCalc workers. Every light is registered with one worker (the least loaded worker, load
+    measured with the light area in pixels) and all its frames are calculated by that worker.
+    All the workers reply into a single queue (see Replies).
+    """
+
+    def __init__(self, workers_: int, event_):
+        """
+        :param workers_: int; number of LightCalc processes
+        :param event_: multiprocessing.Event stopping the workers
+        """
+        assert isinstance(workers_, int), \
+            'Expecting int for argument workers_ got %s ' % type(workers_)
+        assert workers_ > 0, 'argument workers_ should be > 0, got %s ' % workers_
+
+        self.Q_in = [multiprocessing.Queue() for _ in range(workers_)]
+        self.Q_out = multiprocessing.Queue()
+        self.replies = Replies(self.Q_out)
+        self.workers = [LightCalc(queue, self.Q_out, event_) for queue in self.Q_in]
+        # light area (pixels) calculated by each worker and worker index of each light {light id: worker}
+        self.loads = [0] * workers_
+        self.shards = {}
+        self.lock = threading.Lock()
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self):
+        """ Stop the workers (the pending requests are processed first) """
+        for queue in self.Q_in:
+            queue.put((CALC_STOP,))
+        for worker in self.workers:
+            worker.join(timeout=1.0)
+            if worker.is_alive():
+                worker.terminate()
+
+    def register(self, light_id_: int, settings_: tuple, load_: int):
+        """
+        Register a light with the least loaded worker.
+
+        :param light_id_: light id (CreateLight._id)
+        :param settings_: tuple light settings (see LightCalc.register)
+        :param load_: int; light area in pixels
+        """
+        with self.lock:
+            worker = self.loads.index(min(self.loads))
+            self.loads[worker] += load_
+            self.shards[light_id_] = worker
+        self.Q_in[worker].put((CALC_REGISTER, light_id_, settings_))
+
+    def submit(self, light_id_: int, color_index_: int, frame_: int):
+        """ Request a light frame from the worker owning the light (see get) """
+        self.Q_in[self.shards[light_id_]].put((CALC_FRAME, light_id_, color_index_, frame_))
+
+    def get(self, light_id_: int, frame_: int) -> numpy.ndarray:
+        """ Return a light frame requested with submit, wait for the reply if necessary """
+        return self.replies.get(light_id_, frame_)
 
 
 class CreateLight(object):
     """ Define light source properties and methods."""
 
     UPDATE = False
+    # Number of LightCalc processes (see LightPool)
+    WORKERS = 4
+    # Number of frames computed in a background thread ahead of the frame being presented
+    # (see Pipeline.FramePipeline), 0 to compute and present the frames sequentially.
+    PIPELINE_DEPTH = 0
 
     def __init__(self, light_name_, light_shape_, light_shade_, alpha_mask_, light_flickering_, light_variance_,
                  light_rotating_, light_volume_, start_color_gradient_, end_color_gradient_,
@@ -280,6 +394,62 @@ class CreateLight(object):
         # If animation is lagging, increase self.timing e.g 33ms
         self.timing = 30
 
+    def get_light_spot(self):
+        """
+        Return the area flood with light, the mask alpha and the area size, the light area is calculated by the
+        LightSpot process (only the light position and the areas are exchanged).
+        """
+        Q_in.put((self.position, self.light_shape))
+        self.rgb_area, self.mask_area, surface_size = Q_out.get()
+
+        if isinstance(self.alpha_mask, list):
+            mask = self.alpha_mask[0]
+        else:
+            mask = self.alpha_mask
+        return RGB1[self.rgb_area], mask[self.mask_area], surface_size
+
+    def share_textures(self):
+        """
+        Copy the masks alpha and the volumetric textures of the light into the shared memory
+        (once, the masks are shared by the lights using the same masks).
+        """
+        masks = numpy.stack(self.alpha_mask) if isinstance(self.alpha_mask, list) else self.alpha_mask[newaxis]
+        self.mask_texture = TEXTURES.share(('mask', id(self.alpha_mask)), masks)
+        # the light kernel divides the volumetric textures by VOLUME_DIVISOR, the textures are shared
+        # pre-scaled to keep the volume >> 5 scale of this demo
+        self.volume_texture = TEXTURES.share(('volume', self._id), (numpy.stack(self.V0) >> 5) * VOLUME_DIVISOR) \
+            if self.V0 else None
+
+    def register(self):
+        """ Register the light with a LightCalc worker (once, textures are sent as descriptors) """
+        settings = (self.light_shade,
+                    self.light_variance,
+                    self.start_color_gradient, self.end_color_gradient,
+                    self.light_flickering,
+                    self.light_rotating,
+                    self.mask_texture,
+                    self.light_volume,
+                    self.mouse,
+                    self.volume_texture,
+                    self.light_intensity,
+                    (RGB1_TEXTURE, self.rgb_area),
+                    self.mask_area)
+        POOL.register(self._id, settings, self.chunk.shape[0] * self.chunk.shape[1])
+        self.submitted = False
+
+    def submit_frame(self):
+        """ Request the current light frame (color index and frame number) from the LightCalc workers """
+        POOL.submit(self._id, self.color_index, self.counter)
+        self.submitted = True
+
+    def calc_frame(self) -> pygame.Surface:
+        """ Return the current light frame calculated by the LightCalc workers (submitted if necessary) """
+        if not self.submitted:
+            self.submit_frame()
+        new = POOL.get(self._id, self.counter)
+        self.submitted = False
+        return pygame.image.frombuffer(new.transpose(1, 0, 2).copy('C'),
+                                       (new.shape[:2][0], new.shape[:2][1]), 'RGBA')
 
     def flickering(self, rgb_array, alpha_array):
         assert isinstance(rgb_array, numpy.ndarray), \
@@ -312,7 +482,9 @@ class ShowLight(pygame.sprite.Sprite, CreateLight):
 
     def __init__(self, light_settings):
 
-        pygame.sprite.Sprite.__init__(self, self.containers)
+        # the light is added to the groups once initialised (lights can be created by a
+        # threading.Timer while the groups are updated)
+        pygame.sprite.Sprite.__init__(self)
         CreateLight.__init__(self, *light_settings)
 
         assert isinstance(SCREENRECT, pygame.Rect), \
@@ -326,13 +498,7 @@ class ShowLight(pygame.sprite.Sprite, CreateLight):
         self.rect = self.image.get_rect()
         self.color_index = 0
 
-        # self.chunk, self.alpha, surface_size = self.get_light_spot()
-
-        Q_in.put((self.position, self.light_shape, self.alpha_mask, RGB1))
-        Queue = Q_out.get()
-        self.chunk = Queue[0]
-        self.alpha = Queue[1]
-        surface_size = Queue[2]
+        self.chunk, self.alpha, surface_size = self.get_light_spot()
 
         self.V0 = []
         if not self.mouse:
@@ -345,26 +511,9 @@ class ShowLight(pygame.sprite.Sprite, CreateLight):
                 for surface in self.volume:
                     self.V0.append(pygame.surfarray.pixels3d(surface))
 
-
-            Q_in_c.put((self.light_shade,
-            self.light_variance,
-            self.color_index,
-            self.start_color_gradient, self.end_color_gradient,
-            self.light_flickering,
-            self.light_rotating,
-
-            self.alpha_mask,
-            self.counter,
-            self.light_volume,
-            self.mouse,
-            self.V0,    # cannot pickle surface
-            self.light_intensity,
-            self.chunk,
-            self.alpha))
-
-            new = Q_out_c.get()
-            self.image = pygame.image.frombuffer(new.transpose(1, 0, 2).copy('C').astype(numpy.uint8),
-                                       (new.shape[:2][0], new.shape[:2][1]), 'RGBA')
+            self.share_textures()
+            self.register()
+            self.image = self.calc_frame()
 
             self.image_copy = self.image.copy()
 
@@ -376,6 +525,7 @@ class ShowLight(pygame.sprite.Sprite, CreateLight):
         self.rect = self.image.get_rect(center=self.position + self.offset // 2)
         self.color_index = 0
         self.factor = 1
+        self.add(self.containers)
 
 
     def update(self):
@@ -396,24 +546,7 @@ class ShowLight(pygame.sprite.Sprite, CreateLight):
                 # following effects require a constant re-calculation of the light flooded area.
                 if self.light_variance or self.light_rotating or self.light_volume:
 
-                    Q_in_c.put((self.light_shade,
-                                self.light_variance,
-                                self.color_index,
-                                self.start_color_gradient, self.end_color_gradient,
-                                self.light_flickering,
-                                self.light_rotating,
-                                self.alpha_mask,
-                                self.counter,
-                                self.light_volume,
-                                self.mouse,
-                                self.V0,  # cannot pickle surface
-                                self.light_intensity,
-                                self.chunk,
-                                self.alpha))
-
-                    new = Q_out_c.get()
-                    self.image = pygame.image.frombuffer(new.transpose(1, 0, 2).copy('C').astype(numpy.uint8),
-                                                         (new.shape[:2][0], new.shape[:2][1]), 'RGBA')
+                    self.image = self.calc_frame()
 
 
                 elif self.light_flickering:
@@ -435,6 +568,26 @@ class ShowLight(pygame.sprite.Sprite, CreateLight):
         print(time.time() - t)
         self.dt += TIME_PASSED_SECONDS
 
+    def calc_due(self) -> bool:
+        """ True if the light is due for a new frame calculated by the LightCalc workers """
+        return self.dt > self.timing and not self.mouse and \
+            bool(self.light_variance or self.light_rotating or self.light_volume)
+
+    @staticmethod
+    def update_lights(lights_):
+        """
+        Submit all the lights due for a new frame to the workers, then update the lights (gather the replies),
+        the lights are calculated in parallel instead of one round trip at a time.
+
+        :param lights_: sprite group or list of lights
+        """
+        lights = list(lights_)
+        for light in lights:
+            if light.calc_due():
+                light.submit_frame()
+        for light in lights:
+            light.update()
+
 
 if __name__ == '__main__':
 
@@ -451,92 +604,149 @@ if __name__ == '__main__':
 
     Q_out = multiprocessing.Queue()
     Q_in = multiprocessing.Queue()
-    Q_out_c = multiprocessing.Queue()
-    Q_in_c = multiprocessing.Queue()
-    event = multiprocessing.Event()
-    LightSpot(Q_in, Q_out, event).start()
-    LightCalc(Q_in_c, Q_out_c, event).start()
+    stop_event = multiprocessing.Event()
+
+    # Background texture shared with the workers, the masks alpha and volumetric textures are
+    # shared by each light (see CreateLight.share_textures)
+    TEXTURES = SharedTextures()
+    POOL = None
+    SPOT = None
+    pipeline = None
+    # lights created later (see threading.Timer below), cancelled at shutdown
+    TIMERS = []
+    # the shared memory blocks and the worker processes are released even if the demo fails
+    try:
+        RGB1_TEXTURE = TEXTURES.share('RGB1', RGB1)
+
+        SPOT = LightSpot(Q_in, Q_out, stop_event)
+        SPOT.start()
+        # Lights are sharded across the LightCalc workers
+        POOL = LightPool(CreateLight.WORKERS, stop_event)
+        POOL.start()
+
+        for light in LIGHTS:
+
+            if light[0] == 'Spotlight5':
+                timer = threading.Timer(random.randint(2, 7), ShowLight, args=(light,))
+                TIMERS.append(timer)
+                timer.start()
+            else:
+                ShowLight(light)
 
-    for light in LIGHTS:
+        def segment_adjustment(polygon):
+            segments = ALL_SEGMENTS.copy()
+            for seg in polygon:
+                segments.remove(seg)
+            return segments
 
-        if light[0] == 'Spotlight5':
-            threading.Timer(random.randint(2, 7), ShowLight, args=(light,)).start()
-        else:
-            ShowLight(light)
 
-    def segment_adjustment(polygon):
-        segments = ALL_SEGMENTS.copy()
-        for seg in polygon:
-            segments.remove(seg)
-        return segments
+        # list(map(lambda x: LIGHT1_SEGMENTS.remove(x), list(POLYGON2)))
+
+        # Project shadows for specific light sources
+        shadows = [Shadow(segment_adjustment(POLYGON2), static_=True, location_=(370, 94)),    # LIGHT1
+                   Shadow(segment_adjustment(POLYGON1), static_=True, location_=(150, 185)),   # LIGHT6
+                   Shadow(ALL_SEGMENTS, static_=True, location_=(333, 595))                    # LIGHT5
+                   ]
+
+        def compute_frame(mouse_position_):
+            """ Update the lights (LightCalc workers) and project the shadows, return the frame to present or None """
+            ShowLight.update_lights(All)
+            if not CreateLight.UPDATE:
+                return None
+            CreateLight.UPDATE = False
+            polygons = []
+            for shadow in shadows:
+                shadow.update(mouse_position_)
+                polygons.append(shadow.intersects)
+            return [LightFrame(light) for light in All], polygons
 
+        # Pipelined rendering (CreateLight.PIPELINE_DEPTH), the next frames are computed in a background
+        # thread while the current frame is composited and presented (light surfaces are new every frame).
+        pipeline = FramePipeline(compute_frame, CreateLight.PIPELINE_DEPTH) if CreateLight.PIPELINE_DEPTH > 0 else None
 
-    # list(map(lambda x: LIGHT1_SEGMENTS.remove(x), list(POLYGON2)))
+        clock = pygame.time.Clock()
 
-    # Project shadows for specific light sources
-    shadows = [Shadow(segment_adjustment(POLYGON2), static_=True, location_=(370, 94)),    # LIGHT1
-               Shadow(segment_adjustment(POLYGON1), static_=True, location_=(150, 185)),   # LIGHT6
-               Shadow(ALL_SEGMENTS, static_=True, location_=(333, 595))                    # LIGHT5
-               ]
+        while not STOP_GAME:
 
-    clock = pygame.time.Clock()
+            pygame.event.pump()
 
-    while not STOP_GAME:
+            while PAUSE:
+                event = pygame.event.wait()
+                keys = pygame.key.get_pressed()
+                if keys[pygame.K_PAUSE]:
+                    PAUSE = False
+                    pygame.event.clear()
+                    keys = None
+                break
 
-        pygame.event.pump()
+            for event in pygame.event.get():
 
-        while PAUSE:
-            event = pygame.event.wait()
-            keys = pygame.key.get_pressed()
-            if keys[pygame.K_PAUSE]:
-                PAUSE = False
-                pygame.event.clear()
-                keys = None
-            break
+                keys = pygame.key.get_pressed()
 
-        for event in pygame.event.get():
+                if event.type == pygame.QUIT or keys[pygame.K_ESCAPE]:
+                    print('Quitting')
+                    STOP_GAME = True
 
-            keys = pygame.key.get_pressed()
+                elif event.type == pygame.MOUSEMOTION:
+                    MOUSE_POS = event.pos
 
-            if event.type == pygame.QUIT or keys[pygame.K_ESCAPE]:
-                print('Quitting')
-                STOP_GAME = True
+                elif keys[pygame.K_PAUSE]:
+                    PAUSE = True
+                    print('Paused')
 
-            elif event.type == pygame.MOUSEMOTION:
-                MOUSE_POS = event.pos
+            if pipeline is not None:
+                frame = pipeline.next(MOUSE_POS)
+                if frame is not None:
+                    SCREEN.fill((0, 0, 0, 255))
+                    SCREEN.blit(TEXTURE1, (0, 0))
+                    SCREEN.blits([(light.image, light.rect) for light in frame[0]], doreturn=False)
+                    for shadow, polygon in zip(shadows, frame[1]):
+                        shadow.render_frame(SCREEN, polygon)
+                    pygame.display.flip()
 
-            elif keys[pygame.K_PAUSE]:
-                PAUSE = True
-                print('Paused')
+            else:
+                ShowLight.update_lights(All)
 
-        All.update()
+            if pipeline is None and CreateLight.UPDATE:
 
-        if CreateLight.UPDATE:
+                SCREEN.fill((0, 0, 0, 255))
+                SCREEN.blit(TEXTURE1, (0, 0))
+                All.draw(SCREEN)
+                CreateLight.UPDATE = False
+                for shadow in shadows:
+                    shadow.update(MOUSE_POS)
+                    shadow.render_frame()
 
+                pygame.display.flip()
+            """    
             SCREEN.fill((0, 0, 0, 255))
             SCREEN.blit(TEXTURE1, (0, 0))
-            All.draw(SCREEN)
-            CreateLight.UPDATE = False
+
             for shadow in shadows:
                 shadow.update(MOUSE_POS)
                 shadow.render_frame()
 
-            pygame.display.flip()
-        """    
-        SCREEN.fill((0, 0, 0, 255))
-        SCREEN.blit(TEXTURE1, (0, 0))
-
-        for shadow in shadows:
-            shadow.update(MOUSE_POS)
-            shadow.render_frame()
-
-        All.update()
-        All.draw(SCREEN)
+            All.update()
+            All.draw(SCREEN)
         
         
-        pygame.display.flip()
-        """
-        TIME_PASSED_SECONDS = clock.tick(120)
-        FRAME += 1
-
-    pygame.quit()
+            pygame.display.flip()
+            """
+            TIME_PASSED_SECONDS = clock.tick(120)
+            FRAME += 1
+
+    finally:
+        for timer in TIMERS:
+            timer.cancel()
+        if pipeline is not None:
+            pipeline.shutdown()
+        stop_event.set()
+        if SPOT is not None:
+            Q_in.put((CALC_STOP,))
+            SPOT.join(timeout=1.0)
+            if SPOT.is_alive():
+                SPOT.terminate()
+        if POOL is not None:
+            POOL.stop()
+        TEXTURES.close()
+        pygame.quit()
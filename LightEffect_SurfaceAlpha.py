@@ -45,10 +45,11 @@ __status__ = "Demo"
 import pygame
 from pygame import gfxdraw
 import numpy
-from numpy import putmask, dstack, transpose, array, arange, repeat, newaxis
+from numpy import putmask, dstack, transpose
 import timeit
 import random
 import math
+from LightKernels import gradient_lut
 
 
 def make_array(rgb_array_: numpy.ndarray, alpha_: numpy.ndarray) -> numpy.ndarray:
@@ -73,15 +74,7 @@ def gradient(index_: int):
     assert isinstance(index_, int), \
         'Expecting int for argument index_ got %s ' % type(index_)
 
-    value = 256
-    diff_ = (array(GRAD_END_COLOR[:3]) - array(GRAD_START_COLOR[:3])) * value / value
-    row = arange(value, dtype='float') / value
-    row = repeat(row[:, newaxis], [3], 1)
-    diff_ = repeat(diff_[newaxis, :], [value], 0)
-    row = numpy.add(array(GRAD_START_COLOR[:3], numpy.float), array((diff_ * row), numpy.float),
-                    dtype=numpy.float).astype(dtype=numpy.uint8)
-    # return row[index_ % value]
-    return row[index_]
+    return gradient_lut(GRAD_START_COLOR, GRAD_END_COLOR)[index_]
 
 
 def soft_radial_light(rgb1_: numpy.array, alpha2_: pygame.Color, color_index_) -> pygame.Surface:
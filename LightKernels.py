@@ -0,0 +1,267 @@
+"""
+Light shading kernels used by CreateLight.spotlight and CreateLight.flickering (see LightDemo.py).
+
+Three kernels are available:
+
+ - 'float' : the original float64 pipeline
+             rgb_array * (alpha_array * light_intensity * color [* volume_array / 25]), capped to 255.
+
+ - 'fixed' : integer fixed-point pipeline working with uint32 accumulators.
+             The light intensity is folded into an integer scale once per light (see fixed_point_scale),
+             the color gradient is applied with integer products and the final division is a right shift.
+             The resulting image is identical to the float pipeline within +/- 1 LSB.
+
+ - 'fused' : single pass kernel of the selected compute backend (NumPy, Cython or Numba, see Backends.py)
+             writing the light straight into the light surface (see CreateLight.fused_surface).
+             Same result than the float pipeline, the light coefficient is not cached.
+
+Each kernel is split in two passes, the premultiplied light coefficient (mask * intensity * color [* volume])
+that only changes with the light animation state, and the shading pass applying that coefficient to the
+area flood with light (see CreateLight.spotlight for the coefficient cache).
+
+This code comes with a MIT license.
+
+Copyright (c) 2018 Yoann Berenguer
+
+Please acknowledge and give reference if using the source code for your project
+"""
+
+__author__ = "Yoann Berenguer"
+__copyright__ = "Copyright 2007."
+__credits__ = ["Yoann Berenguer"]
+__license__ = "MIT License"
+__version__ = "2.0.0"
+__maintainer__ = "Yoann Berenguer"
+__email__ = "yoyoberenguer@hotmail.com"
+__status__ = "Demo"
+
+import math
+import numpy
+
+# Kernel names (see CreateLight.KERNEL)
+FLOAT_KERNEL = 'float'
+FIXED_KERNEL = 'fixed'
+FUSED_KERNEL = 'fused'
+KERNELS = (FLOAT_KERNEL, FIXED_KERNEL, FUSED_KERNEL)
+
+# The volumetric texture is divided by 25 before being applied to the light (see CreateLight.spotlight)
+VOLUME_DIVISOR = 25
+
+# Largest fractional precision (in bits) of the light coefficient.
+MAX_SHIFT = 24
+
+UINT32_MAX = 0xffffffff
+
+# Gradient look-up tables shared by all the lights, key (start color, end color)
+GRADIENT_LUT = {}
+
+# Color index sequence played by ShowLight.update (0, 1 ... 255, 254 ... 1) and repeated.
+GRADIENT_PING_PONG = numpy.concatenate((numpy.arange(256), numpy.arange(254, 0, -1)))
+GRADIENT_PING_PONG.flags.writeable = False
+
+
+def fixed_point_scale(light_intensity_: float, volume_: bool = False) -> tuple:
+    """
+    Fold the light intensity into an integer scale (to be called once per light).
+
+    The fixed-point kernel works in two passes:
+    coefficient = (alpha * scale * color [* volume]) >> pre_shift   (light coefficient with <shift> fractional bits)
+    rgb         = (rgb_array * coefficient) >> shift                 (capped to 255)
+    Both shifts are chosen to give the best precision without overflowing the uint32 accumulators.
+
+    :param light_intensity_: float; light intensity e.g 0.7e-4
+    :param volume_: bool; True if the light is using a volumetric texture
+    :return: tuple (scale, shift, pre_shift)
+    """
+    assert light_intensity_ > 0, 'argument light_intensity_ should be > 0, got %s ' % light_intensity_
+
+    factor = light_intensity_ / VOLUME_DIVISOR if volume_ else light_intensity_
+    # largest value of alpha * volume
+    mask_max = 255 * 255 if volume_ else 255
+
+    # rgb_array * coefficient must fit in an uint32 (coefficient <= mask_max * factor * 255 << shift)
+    shift = min(MAX_SHIFT, int(math.log2(UINT32_MAX / (255.0 * 255.0 * mask_max * factor))))
+    assert shift >= 0, 'light intensity %s is too high for the fixed-point kernel' % light_intensity_
+    # alpha * scale * color must fit in an uint32
+    total = int(math.log2(UINT32_MAX / (255.0 * 255.0 * factor)))
+
+    return int(round(factor * (1 << total))), shift, total - shift
+
+
+def gradient_lut(start_color_gradient_, end_color_gradient_) -> numpy.ndarray:
+    """
+    Return the color gradient table (linear interpolation) between two colors.
+
+    The table is built once for a given pair of colors and shared by all the lights using the same
+    gradient endpoints (module registry GRADIENT_LUT), looking up a color does not allocate anything.
+
+    :param start_color_gradient_: start color (R, G, B[, A])
+    :param end_color_gradient_: end color (R, G, B[, A])
+    :return: numpy.ndarray (256, 3) uint8 read-only
+    """
+    key = (tuple(start_color_gradient_[:3]), tuple(end_color_gradient_[:3]))
+    try:
+        return GRADIENT_LUT[key]
+    except KeyError:
+        pass
+
+    diff_ = numpy.array(key[1]) - numpy.array(key[0])
+    row = numpy.arange(256, dtype=numpy.float64) / 256
+    row = numpy.repeat(row[:, numpy.newaxis], [3], 1)
+    diff_ = numpy.repeat(diff_[numpy.newaxis, :], [256], 0)
+    table = numpy.add(numpy.array(key[0], numpy.float64), diff_ * row).astype(dtype=numpy.uint8)
+    table.flags.writeable = False
+
+    GRADIENT_LUT[key] = table
+    return table
+
+
+def light_coefficient_float(alpha_array: numpy.ndarray, light_intensity: float, color,
+                            volume_array: numpy.ndarray = None, out: numpy.ndarray = None,
+                            scratch: numpy.ndarray = None) -> numpy.ndarray:
+    """
+    Premultiplied float64 light coefficient (mask * intensity * color [* volume / 25]).
+
+    :param alpha_array: numpy.ndarray (w, h, 1) uint8 mask alpha (radial light intensity)
+    :param light_intensity: float; light intensity
+    :param color: light color (R, G, B)
+    :param volume_array: numpy.ndarray (w, h, 3) uint8 volumetric texture or None
+    :param out: numpy.ndarray (w, h, 3) float64 receiving the coefficient or None
+    :param scratch: numpy.ndarray (w, h, 3) float64 work array for the volumetric texture or None
+    :return: numpy.ndarray (w, h, 3) float64
+    """
+    if out is None:
+        out = numpy.empty((*alpha_array.shape[:2], 3), dtype=numpy.float64)
+
+    numpy.multiply(alpha_array, light_intensity, out=out)
+    numpy.multiply(out, color, out=out)
+    if volume_array is not None:
+        numpy.multiply(out, numpy.divide(volume_array, VOLUME_DIVISOR, out=scratch), out=out)
+    return out
+
+
+def shade_float(rgb_array: numpy.ndarray, coefficient: numpy.ndarray, out: numpy.ndarray = None) -> numpy.ndarray:
+    """
+    Apply a float64 light coefficient to the area flood with light.
+
+    :param rgb_array: numpy.ndarray (w, h, 3) uint8 representing the area flood with light
+    :param coefficient: numpy.ndarray (w, h, 3) float64 returned by light_coefficient_float
+    :param out: numpy.ndarray (w, h, 3) float64 receiving the result or None
+    :return: numpy.ndarray (w, h, 3) float64 capped to 255
+    """
+    # light resultant calculation
+    new_array = numpy.multiply(rgb_array, coefficient, out=out)
+
+    # Cap the array
+    numpy.minimum(new_array, 255, out=new_array)
+    return new_array
+
+
+def light_coefficient_fixed(alpha_array: numpy.ndarray, fixed_point: tuple, color,
+                            volume_array: numpy.ndarray = None, out: numpy.ndarray = None) -> numpy.ndarray:
+    """
+    Premultiplied fixed-point light coefficient (mask * intensity * color [* volume / 25]).
+
+    :param alpha_array: numpy.ndarray (w, h, 1) uint8 mask alpha (radial light intensity)
+    :param fixed_point: tuple (scale, shift, pre_shift) returned by fixed_point_scale
+    :param color: light color (R, G, B)
+    :param volume_array: numpy.ndarray (w, h, 3) uint8 volumetric texture or None
+    :param out: numpy.ndarray (w, h, 3) uint32 receiving the coefficient or None
+    :return: numpy.ndarray (w, h, 3) uint32 with <shift> fractional bits
+    """
+    scale, shift, pre_shift = fixed_point
+    k = numpy.multiply(numpy.asarray(color[:3], dtype=numpy.uint32), scale, dtype=numpy.uint32)
+
+    if out is None:
+        out = numpy.empty((*alpha_array.shape[:2], 3), dtype=numpy.uint32)
+
+    numpy.multiply(alpha_array, k, out=out)
+    if volume_array is not None:
+        # keep alpha * scale * color * volume within 32 bits
+        out >>= 8
+        out *= volume_array
+        out >>= pre_shift - 8
+    else:
+        out >>= pre_shift
+    return out
+
+
+def shade_fixed(rgb_array: numpy.ndarray, coefficient: numpy.ndarray, shift: int,
+                out: numpy.ndarray = None) -> numpy.ndarray:
+    """
+    Apply a fixed-point light coefficient to the area flood with light.
+
+    :param rgb_array: numpy.ndarray (w, h, 3) uint8 representing the area flood with light
+    :param coefficient: numpy.ndarray (w, h, 3) uint32 returned by light_coefficient_fixed
+    :param shift: int; number of fractional bits of the coefficient
+    :param out: numpy.ndarray (w, h, 3) uint32 receiving the result or None
+    :return: numpy.ndarray (w, h, 3) uint32 capped to 255
+    """
+    # light resultant calculation
+    new_array = numpy.multiply(rgb_array, coefficient, out=out, dtype=numpy.uint32)
+    new_array >>= shift
+
+    # Cap the array
+    numpy.minimum(new_array, 255, out=new_array)
+    return new_array
+
+
+def spotlight_float(rgb_array: numpy.ndarray, alpha_array: numpy.ndarray, light_intensity: float,
+                    color, volume_array: numpy.ndarray = None) -> numpy.ndarray:
+    """
+    Float64 light kernel (reference).
+
+    :param rgb_array: numpy.ndarray (w, h, 3) uint8 representing the area flood with light
+    :param alpha_array: numpy.ndarray (w, h, 1) uint8 mask alpha (radial light intensity)
+    :param light_intensity: float; light intensity
+    :param color: light color (R, G, B)
+    :param volume_array: numpy.ndarray (w, h, 3) uint8 volumetric texture or None
+    :return: numpy.ndarray (w, h, 3) float64 capped to 255
+    """
+    return shade_float(rgb_array, light_coefficient_float(alpha_array, light_intensity, color, volume_array))
+
+
+def spotlight_batch_float(rgb_arrays: numpy.ndarray, alpha_arrays: numpy.ndarray, light_intensities,
+                          colors, volume_arrays: numpy.ndarray = None) -> numpy.ndarray:
+    """
+    Float64 light kernel applied to a batch of lights of the same shape with a single call per operation
+    (the lights are stacked along the first axis), same result than spotlight_float for each light.
+
+    :param rgb_arrays: numpy.ndarray (n, w, h, 3) uint8 areas flood with light
+    :param alpha_arrays: numpy.ndarray (n, w, h, 1) uint8 masks alpha
+    :param light_intensities: n light intensities (float)
+    :param colors: n light colors (R, G, B)
+    :param volume_arrays: numpy.ndarray (n, w, h, 3) uint8 volumetric textures or None
+    :return: numpy.ndarray (n, w, h, 3) float64 capped to 255
+    """
+    intensities = numpy.asarray(light_intensities, dtype=numpy.float64).reshape(-1, 1, 1, 1)
+    colors = numpy.asarray(colors, dtype=numpy.float64).reshape(-1, 1, 1, 3)
+
+    coefficient = numpy.empty((*alpha_arrays.shape[:3], 3), dtype=numpy.float64)
+    numpy.multiply(alpha_arrays, intensities, out=coefficient)
+    numpy.multiply(coefficient, colors, out=coefficient)
+    if volume_arrays is not None:
+        numpy.multiply(coefficient, numpy.divide(volume_arrays, VOLUME_DIVISOR), out=coefficient)
+    return shade_float(rgb_arrays, coefficient, out=coefficient)
+
+
+def light_kernel(rgb_array: numpy.ndarray, alpha_array: numpy.ndarray, light_intensity: float,
+                 red: int, green: int, blue: int, destination: numpy.ndarray, destination_alpha: numpy.ndarray,
+                 volume_array: numpy.ndarray = None):
+    """
+    NumPy version of the fused light kernel (backend 'numpy', see Backends.py), the float64 light is written
+    into the light surface buffers with the mask alpha.
+
+    :param rgb_array: numpy.ndarray (w, h, 3) uint8 representing the area flood with light
+    :param alpha_array: numpy.ndarray (w, h, 1) uint8 mask alpha (radial light intensity)
+    :param light_intensity: float; light intensity
+    :param red: light color red component
+    :param green: light color green component
+    :param blue: light color blue component
+    :param destination: numpy.ndarray (w, h, 3) uint8 receiving the light (e.g pixels3d view of the light surface)
+    :param destination_alpha: numpy.ndarray (w, h) uint8 receiving the mask alpha (e.g pixels_alpha view)
+    :param volume_array: numpy.ndarray (w, h, 3) uint8 volumetric texture or None
+    """
+    numpy.copyto(destination, spotlight_float(rgb_array, alpha_array, light_intensity, (red, green, blue),
+                                              volume_array), casting='unsafe')
+    numpy.copyto(destination_alpha, alpha_array[:, :, 0])
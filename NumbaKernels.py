@@ -0,0 +1,233 @@
+"""
+Numba kernels of the compute backend 'numba' (see Backends.py).
+
+Same kernels than CythonVersion/Kernels.pyx compiled at runtime with @njit(parallel=True), the rows (rays) are
+processed in parallel with prange. The functions are compiled on first use and cached on disk (cache=True).
+
+ - light_kernel       : fused light shading written straight into the light surface buffers
+                        (same result than LightKernels.spotlight_float)
+ - visibility_polygon : shadow casting (same polygon than ShadowKernels.visibility_polygon)
+ - grid_visibility_polygon : shadow casting through a segment grid, each ray walks through the cells it crosses
+                        (same polygon than ShadowKernels.grid_visibility_polygon)
+
+This module requires numba (ImportError otherwise, see Backends.load_backend).
+
+This code comes with a MIT license.
+
+Copyright (c) 2018 Yoann Berenguer
+
+Please acknowledge and give reference if using the source code for your project
+"""
+
+__author__ = "Yoann Berenguer"
+__copyright__ = "Copyright 2007."
+__credits__ = ["Yoann Berenguer"]
+__license__ = "MIT License"
+__version__ = "2.0.0"
+__maintainer__ = "Yoann Berenguer"
+__email__ = "yoyoberenguer@hotmail.com"
+__status__ = "Demo"
+
+import math
+import numpy
+from numba import njit, prange
+
+from ShadowKernels import RAY_OFFSET
+from LightKernels import VOLUME_DIVISOR
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def _light_kernel(rgb_array, alpha_array, light_intensity, color, destination, destination_alpha,
+                  volume_array, volume):
+    w, h = rgb_array.shape[0], rgb_array.shape[1]
+    for i in prange(w):
+        for j in range(h):
+            a = alpha_array[i, j, 0] * light_intensity
+            for c in range(3):
+                # same operation order than the numpy version (see LightKernels.spotlight_float)
+                v = a * color[c]
+                if volume:
+                    v = v * (volume_array[i, j, c] / VOLUME_DIVISOR)
+                v = rgb_array[i, j, c] * v
+                if v > 255.0:
+                    v = 255.0
+                destination[i, j, c] = numpy.uint8(v)
+            destination_alpha[i, j] = alpha_array[i, j, 0]
+
+
+@njit(nogil=True, cache=True)
+def _ray_parameter(r_dx, r_dy, r_mag, segments, k, x, y):
+    # ray parameter T1 of the intersection with the segment k, inf if none
+    s_dx = segments[k, 2] - segments[k, 0]
+    s_dy = segments[k, 3] - segments[k, 1]
+    s_mag = s_dx * s_dx + s_dy * s_dy
+    # parallel lines, no intersection
+    if r_dx / r_mag == s_dx / s_mag and r_dy / r_mag == s_dy / s_mag:
+        return math.inf
+    d = s_dx * r_dy - s_dy * r_dx
+    if d == 0:
+        d = d - 0.01
+    t2 = (r_dx * (segments[k, 1] - y) + r_dy * (x - segments[k, 0])) / d
+    d = r_dx
+    if d == 0:
+        d = d - 0.01
+    t1 = (segments[k, 0] + s_dx * t2 - x) / d
+    if t1 < 0 or t2 < 0 or t2 > 1:
+        return math.inf
+    return t1
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def _cast_rays(segments, angles, x, y, points, found):
+    n = segments.shape[0]
+    for i in prange(3 * angles.shape[0]):
+        angle = angles[i // 3] + (i % 3 - 1) * RAY_OFFSET
+        # same operations than the ray dict (b - a)
+        r_dx = (x + math.cos(angle)) - x
+        r_dy = (y + math.sin(angle)) - y
+        r_mag = r_dx * r_dx + r_dy * r_dy
+        closest = math.inf
+        for k in range(n):
+            closest = min(closest, _ray_parameter(r_dx, r_dy, r_mag, segments, k, x, y))
+        if closest < math.inf:
+            points[i, 0] = x + r_dx * closest
+            points[i, 1] = y + r_dy * closest
+            points[i, 2] = angle
+        found[i] = closest < math.inf
+
+
+@njit(parallel=True, nogil=True, cache=True)
+def _cast_grid_rays(segments, cell_start, cell_segments, left, top, cell_size, columns, rows,
+                    angles, x, y, points, found):
+    right, bottom = left + columns * cell_size, top + rows * cell_size
+    for i in prange(3 * angles.shape[0]):
+        angle = angles[i // 3] + (i % 3 - 1) * RAY_OFFSET
+        # same operations than the ray dict (b - a)
+        r_dx = (x + math.cos(angle)) - x
+        r_dy = (y + math.sin(angle)) - y
+        r_mag = r_dx * r_dx + r_dy * r_dy
+        closest = math.inf
+
+        if r_dx == 0:
+            # vertical ray, T1 is not a distance along the ray, intersected with all the segments
+            for k in range(segments.shape[0]):
+                closest = min(closest, _ray_parameter(r_dx, r_dy, r_mag, segments, k, x, y))
+        else:
+            # grid entry and exit (slab method)
+            tx0, tx1 = (left - x) / r_dx, (right - x) / r_dx
+            t_enter, t_leave = max(min(tx0, tx1), 0.0), max(tx0, tx1)
+            if r_dy != 0:
+                ty0, ty1 = (top - y) / r_dy, (bottom - y) / r_dy
+                t_enter, t_leave = max(t_enter, min(ty0, ty1)), min(t_leave, max(ty0, ty1))
+            elif y < top or y > bottom:
+                t_enter = math.inf
+
+            if t_enter <= t_leave:
+                column = min(max(int(math.floor((x + r_dx * t_enter - left) / cell_size)), 0), columns - 1)
+                row = min(max(int(math.floor((y + r_dy * t_enter - top) / cell_size)), 0), rows - 1)
+                step_x = 1 if r_dx > 0 else -1
+                t_max_x = (left + (column + (1 if r_dx > 0 else 0)) * cell_size - x) / r_dx
+                t_delta_x = cell_size / abs(r_dx)
+                step_y, t_max_y, t_delta_y = 0, math.inf, math.inf
+                if r_dy != 0:
+                    step_y = 1 if r_dy > 0 else -1
+                    t_max_y = (top + (row + (1 if r_dy > 0 else 0)) * cell_size - y) / r_dy
+                    t_delta_y = cell_size / abs(r_dy)
+
+                while 0 <= column < columns and 0 <= row < rows:
+                    cell = row * columns + column
+                    for k in range(cell_start[cell], cell_start[cell + 1]):
+                        closest = min(closest, _ray_parameter(r_dx, r_dy, r_mag, segments, cell_segments[k], x, y))
+                    # closest intersection within the visited cells
+                    if closest <= min(t_max_x, t_max_y):
+                        break
+                    if t_max_x < t_max_y:
+                        column += step_x
+                        t_max_x += t_delta_x
+                    else:
+                        row += step_y
+                        t_max_y += t_delta_y
+
+        if closest < math.inf:
+            points[i, 0] = x + r_dx * closest
+            points[i, 1] = y + r_dy * closest
+            points[i, 2] = angle
+        found[i] = closest < math.inf
+
+
+def light_kernel(rgb_array: numpy.ndarray, alpha_array: numpy.ndarray, light_intensity: float,
+                 red: int, green: int, blue: int, destination: numpy.ndarray, destination_alpha: numpy.ndarray,
+                 volume_array: numpy.ndarray = None):
+    """
+    Fused light kernel, rgb_array * (alpha_array * light_intensity * color [* volume_array / 25]) capped to 255
+    is written straight into the light surface buffers with the mask alpha.
+
+    :param rgb_array: numpy.ndarray (w, h, 3) uint8 representing the area flood with light
+    :param alpha_array: numpy.ndarray (w, h, 1) uint8 mask alpha (radial light intensity)
+    :param light_intensity: float; light intensity
+    :param red: light color red component
+    :param green: light color green component
+    :param blue: light color blue component
+    :param destination: numpy.ndarray (w, h, 3) uint8 receiving the light (e.g pixels3d view of the light surface)
+    :param destination_alpha: numpy.ndarray (w, h) uint8 receiving the mask alpha (e.g pixels_alpha view)
+    :param volume_array: numpy.ndarray (w, h, 3) uint8 volumetric texture or None
+    """
+    w, h = rgb_array.shape[:2]
+    if alpha_array.shape[0] < w or alpha_array.shape[1] < h or destination.shape[0] < w or \
+            destination.shape[1] < h or destination_alpha.shape[0] < w or destination_alpha.shape[1] < h or \
+            (volume_array is not None and (volume_array.shape[0] < w or volume_array.shape[1] < h)):
+        raise ValueError('light_kernel arrays shapes are not matching')
+
+    color = numpy.array((red, green, blue), dtype=numpy.float64)
+    # a single compiled signature, the volume flag disables the (dummy) volume array
+    _light_kernel(rgb_array, alpha_array, float(light_intensity), color, destination, destination_alpha,
+                  rgb_array if volume_array is None else volume_array, volume_array is not None)
+
+
+def visibility_polygon(segments: numpy.ndarray, x: float, y: float, angles: numpy.ndarray = None) -> numpy.ndarray:
+    """
+    Cast the rays from (x, y) and return the visibility polygon.
+
+    :param segments: numpy.ndarray (n, 4) float64 segment end points (ax, ay, bx, by)
+    :param x: ray origin x coordinate (light or mouse position)
+    :param y: ray origin y coordinate
+    :param angles: numpy.ndarray (j, ) float64 angles of the corners (see ShadowKernels.corner_angles),
+                   None to cast the rays towards the end point a of every segment
+    :return: numpy.ndarray (m, 3) float64 C contiguous, intersections (x, y, angle) sorted by angle
+    """
+    segments = numpy.ascontiguousarray(segments, dtype=numpy.float64)
+    if angles is None:
+        angles = numpy.arctan2(segments[:, 1] - y, segments[:, 0] - x)
+    rays = 3 * len(angles)
+    points = numpy.empty((rays, 3), dtype=numpy.float64)
+    found = numpy.zeros(rays, dtype=numpy.bool_)
+    _cast_rays(segments, numpy.ascontiguousarray(angles, dtype=numpy.float64), float(x), float(y), points, found)
+    polygon = points[found]
+    # stable sort, rays with identical angles are kept in the casting order
+    return numpy.ascontiguousarray(polygon[numpy.argsort(polygon[:, 2], kind='stable')])
+
+
+def grid_visibility_polygon(grid, x: float, y: float, angles: numpy.ndarray = None) -> numpy.ndarray:
+    """
+    Cast the rays from (x, y) through the segment grid and return the visibility polygon
+    (same polygon than visibility_polygon with all the segments).
+
+    :param grid: SegmentGrid.GridIndex (see SegmentGrid.index)
+    :param x: ray origin x coordinate (light or mouse position)
+    :param y: ray origin y coordinate
+    :param angles: numpy.ndarray (j, ) float64 angles of the corners (see ShadowKernels.corner_angles),
+                   None to cast the rays towards the end point a of every segment
+    :return: numpy.ndarray (m, 3) float64 C contiguous, intersections (x, y, angle) sorted by angle
+    """
+    segments = numpy.ascontiguousarray(grid.segments, dtype=numpy.float64)
+    if angles is None:
+        angles = numpy.arctan2(segments[:, 1] - y, segments[:, 0] - x)
+    rays = 3 * len(angles)
+    points = numpy.empty((rays, 3), dtype=numpy.float64)
+    found = numpy.zeros(rays, dtype=numpy.bool_)
+    _cast_grid_rays(segments, grid.cell_start, grid.cell_segments, float(grid.left), float(grid.top),
+                    float(grid.cell_size), int(grid.columns), int(grid.rows),
+                    numpy.ascontiguousarray(angles, dtype=numpy.float64), float(x), float(y), points, found)
+    polygon = points[found]
+    # stable sort, rays with identical angles are kept in the casting order
+    return numpy.ascontiguousarray(polygon[numpy.argsort(polygon[:, 2], kind='stable')])
@@ -0,0 +1,78 @@
+"""
+Pipelined frame rendering.
+
+The frame computation (light updates and shadow projections) runs in a background thread while the main
+thread composites and presents the previous frame. Up to <depth> frames are computed ahead of the frame
+being presented, the frame rate is then limited by the slowest stage instead of the sum of the stages.
+
+A computed frame must not be modified by the next computations, the lights are captured with LightFrame
+(light surface and position) and the light surfaces are double buffered (see CreateLight.light_surface).
+
+This code comes with a MIT license.
+
+Copyright (c) 2018 Yoann Berenguer
+
+Please acknowledge and give reference if using the source code for your project
+"""
+
+__author__ = "Yoann Berenguer"
+__copyright__ = "Copyright 2007."
+__credits__ = ["Yoann Berenguer"]
+__license__ = "MIT License"
+__version__ = "2.0.0"
+__maintainer__ = "Yoann Berenguer"
+__email__ = "yoyoberenguer@hotmail.com"
+__status__ = "Demo"
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LightFrame:
+    """ Light surface and position captured for a pipelined frame, other attributes are read from the light. """
+
+    __slots__ = ('light', 'image', 'rect')
+
+    def __init__(self, light_):
+        self.light = light_
+        self.image = light_.image
+        self.rect = light_.rect.copy()
+
+    def __getattr__(self, name_):
+        return getattr(self.light, name_)
+
+
+class FramePipeline:
+    """ Compute the next frames in a background thread while the current frame is presented. """
+
+    def __init__(self, compute_, depth_: int = 1):
+        """
+        :param compute_: function computing a frame (called in the background thread, in order)
+        :param depth_: int; number of frames computed ahead of the frame being presented
+        """
+        assert callable(compute_), 'Expecting callable for argument compute_ got %s ' % type(compute_)
+        assert isinstance(depth_, int), 'Expecting int for argument depth_ got %s ' % type(depth_)
+        assert depth_ > 0, 'argument depth_ should be > 0, got %s ' % depth_
+
+        self.compute = compute_
+        self.depth = depth_
+        # a single thread keeps the frames computed in order
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.frames = deque()
+
+    def next(self, *args):
+        """
+        Submit the computation of the next frames and return the oldest computed frame
+        (wait for it if necessary).
+
+        :param args: arguments passed to the compute function (e.g the mouse position)
+        :return: the value returned by the compute function for the oldest frame
+        """
+        while len(self.frames) <= self.depth:
+            self.frames.append(self.executor.submit(self.compute, *args))
+        return self.frames.popleft().result()
+
+    def shutdown(self):
+        """ Wait for the frames in flight and stop the background thread """
+        self.executor.shutdown()
+        self.frames.clear()
@@ -0,0 +1,185 @@
+"""
+Uniform grid index of the occluder segments, broad phase of the shadow casting (see Shadow.update).
+
+The bounding box of the segments is divided into square cells, each cell references the segments crossing
+it (segment bounding box padded by GRID_PADDING). A ray cast from the light position walks through the cells
+it crosses (DDA, see ShadowKernels.grid_visibility_polygon) and is only intersected with the segments
+referenced by these cells, the walk stops as soon as the closest intersection found lies in the cells already
+visited. The visibility polygon is the same than the polygon calculated with all the segments
+(see ShadowKernels.visibility_polygon).
+
+Segments can be added or removed without rebuilding the index, only the cells crossed by the segment are
+updated. The index is passed to the kernels as a GridIndex (compact arrays, rebuilt once after changes):
+
+    grid = SegmentGrid(segments, 32)
+    grid.add((10.0, 10.0, 50.0, 10.0))
+    polygon = get_backend().grid_visibility_polygon(grid.index(), x, y, angles)
+
+This code comes with a MIT license.
+
+Copyright (c) 2018 Yoann Berenguer
+
+Please acknowledge and give reference if using the source code for your project
+"""
+
+__author__ = "Yoann Berenguer"
+__copyright__ = "Copyright 2007."
+__credits__ = ["Yoann Berenguer"]
+__license__ = "MIT License"
+__version__ = "2.0.0"
+__maintainer__ = "Yoann Berenguer"
+__email__ = "yoyoberenguer@hotmail.com"
+__status__ = "Demo"
+
+import math
+import numpy
+from collections import namedtuple
+from itertools import chain
+
+# Margin added around the segments when they are referenced by the cells (pixels), an intersection found
+# on a cell boundary is then always referenced by the cells on both sides.
+GRID_PADDING = 1.0
+
+# Arguments of the grid kernels (see Backends.py)
+#   segments      : numpy.ndarray (n, 4) float64 segment end points (ax, ay, bx, by)
+#   cell_start    : numpy.ndarray (columns * rows + 1, ) int32, segments of the cell c are
+#                   cell_segments[cell_start[c]:cell_start[c + 1]] (cell c = row * columns + column)
+#   cell_segments : numpy.ndarray (k, ) int32 segment indices
+#   left, top     : grid top left corner
+#   cell_size     : cell width and height
+#   columns, rows : grid size in cells
+GridIndex = namedtuple('GridIndex', ('segments', 'cell_start', 'cell_segments',
+                                     'left', 'top', 'cell_size', 'columns', 'rows'))
+
+
+class SegmentGrid:
+    """ Uniform grid of segments, updated incrementally (see add and remove). """
+
+    def __init__(self, segments_: numpy.ndarray, cell_size_: int):
+        """
+        :param segments_: numpy.ndarray (n, 4) float64 segment end points (ax, ay, bx, by)
+                          (see ShadowKernels.segment_array)
+        :param cell_size_: int; cell width and height in pixels
+        """
+        assert isinstance(segments_, numpy.ndarray), \
+            'Expecting numpy.ndarray for argument segments_ got %s ' % type(segments_)
+        assert isinstance(cell_size_, int), 'Expecting int for argument cell_size_ got %s ' % type(cell_size_)
+        assert cell_size_ > 0, 'argument cell_size_ should be > 0, got %s ' % cell_size_
+
+        self.cell_size = float(cell_size_)
+        self.build([tuple(segment) for segment in segments_.tolist()])
+
+    def build(self, segments_: list):
+        """
+        Build the grid over the bounding box of the segments.
+
+        :param segments_: list of segment end points (ax, ay, bx, by)
+        """
+        if segments_:
+            points = numpy.array(segments_, dtype=numpy.float64).reshape(-1, 2)
+            x_min, y_min = points.min(axis=0) - GRID_PADDING
+            x_max, y_max = points.max(axis=0) + GRID_PADDING
+        else:
+            x_min = y_min = x_max = y_max = 0.0
+        self.left, self.top = math.floor(x_min), math.floor(y_min)
+        self.columns = max(1, int(math.ceil((x_max - self.left) / self.cell_size)))
+        self.rows = max(1, int(math.ceil((y_max - self.top) / self.cell_size)))
+
+        # segment end points per slot, None for a removed segment (free slot)
+        self.slots = []
+        self.free = []
+        # {(ax, ay, bx, by): [slots]}
+        self.lookup = {}
+        # slots of the segments crossing each cell
+        self.cells = [[] for _ in range(self.columns * self.rows)]
+        # GridIndex built from the cells (see index)
+        self.grid_index = None
+        for segment in segments_:
+            self.add(segment)
+
+    def contains(self, segment_: tuple) -> bool:
+        """ return True if the padded segment lies within the grid """
+        ax, ay, bx, by = segment_
+        return min(ax, bx) - GRID_PADDING >= self.left and min(ay, by) - GRID_PADDING >= self.top and \
+            max(ax, bx) + GRID_PADDING <= self.left + self.columns * self.cell_size and \
+            max(ay, by) + GRID_PADDING <= self.top + self.rows * self.cell_size
+
+    def segment_cells(self, segment_: tuple) -> list:
+        """
+        :param segment_: tuple (ax, ay, bx, by) segment within the grid
+        :return: list of the cells crossed by the padded segment bounding box
+        """
+        ax, ay, bx, by = segment_
+        column_min = max(0, int((min(ax, bx) - GRID_PADDING - self.left) // self.cell_size))
+        column_max = min(self.columns - 1, int((max(ax, bx) + GRID_PADDING - self.left) // self.cell_size))
+        row_min = max(0, int((min(ay, by) - GRID_PADDING - self.top) // self.cell_size))
+        row_max = min(self.rows - 1, int((max(ay, by) + GRID_PADDING - self.top) // self.cell_size))
+        return [row * self.columns + column for row in range(row_min, row_max + 1)
+                for column in range(column_min, column_max + 1)]
+
+    def add(self, segment_: tuple):
+        """
+        Add a segment, only the cells crossed by the segment are updated (the grid is rebuilt if the segment
+        lies outside of the grid).
+
+        :param segment_: tuple (ax, ay, bx, by) segment end points
+        """
+        assert isinstance(segment_, tuple), 'Expecting tuple for argument segment_ got %s ' % type(segment_)
+        segment = tuple(float(value) for value in segment_)
+        if not self.contains(segment):
+            self.build([slot for slot in self.slots if slot is not None] + [segment])
+            return
+
+        slot = self.free.pop() if self.free else len(self.slots)
+        if slot == len(self.slots):
+            self.slots.append(segment)
+        else:
+            self.slots[slot] = segment
+        self.lookup.setdefault(segment, []).append(slot)
+        for cell in self.segment_cells(segment):
+            self.cells[cell].append(slot)
+        self.grid_index = None
+
+    def remove(self, segment_: tuple):
+        """
+        Remove a segment, only the cells crossed by the segment are updated.
+
+        :param segment_: tuple (ax, ay, bx, by) segment end points
+        :raise ValueError: if the segment is not in the grid
+        """
+        assert isinstance(segment_, tuple), 'Expecting tuple for argument segment_ got %s ' % type(segment_)
+        segment = tuple(float(value) for value in segment_)
+        slots = self.lookup.get(segment)
+        if not slots:
+            raise ValueError('segment %s is not in the grid' % (segment_,))
+
+        slot = slots.pop()
+        if not slots:
+            del self.lookup[segment]
+        for cell in self.segment_cells(segment):
+            self.cells[cell].remove(slot)
+        self.slots[slot] = None
+        self.free.append(slot)
+        self.grid_index = None
+
+    def index(self) -> GridIndex:
+        """
+        return the GridIndex passed to the grid kernels, built once after the segments are changed
+        (segment slots compacted and cells flattened)
+        """
+        if self.grid_index is None:
+            live = [slot for slot, segment in enumerate(self.slots) if segment is not None]
+            # slot -> index of the segment in the compact segment array
+            compact = numpy.full(len(self.slots), -1, dtype=numpy.int32)
+            compact[live] = numpy.arange(len(live), dtype=numpy.int32)
+
+            counts = numpy.array([len(cell) for cell in self.cells], dtype=numpy.int32)
+            cell_start = numpy.zeros(len(self.cells) + 1, dtype=numpy.int32)
+            numpy.cumsum(counts, out=cell_start[1:])
+            slots = numpy.fromiter(chain.from_iterable(self.cells), dtype=numpy.int32, count=int(cell_start[-1]))
+
+            self.grid_index = GridIndex(
+                numpy.array([self.slots[slot] for slot in live], dtype=numpy.float64).reshape(-1, 4),
+                cell_start, numpy.ascontiguousarray(compact[slots]),
+                float(self.left), float(self.top), self.cell_size, self.columns, self.rows)
+        return self.grid_index
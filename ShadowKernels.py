@@ -0,0 +1,248 @@
+"""
+Shadow casting kernel used by Shadow.update (see Shadows.py) with the compute backend 'numpy' (see Backends.py).
+
+The segments are passed as a float64 array (n, 4) of end points (ax, ay, bx, by) instead of the segment dicts.
+For each corner, three rays are cast from the light position (angle - 0.00001, angle and angle + 0.00001,
+the two extra rays are needed to hit the wall(s) behind any given segment corner) and the closest intersection
+with all the segments is kept (same algorithm and arithmetic than Shadow.get_intersection).
+
+The corners are the unique segment end points (adjacent segments are sharing their end points), built once
+per segment list (unique_corners). The angles of the rays are calculated once per light position and
+deduplicated (corner_angles), without them the rays are cast towards the end point a of every segment.
+
+The rays are intersected with all the segments at once (rays x segments matrices, numpy broadcasting), the
+closest intersection of each ray is selected (minimum of T1) and the polygon is sorted by angle with argsort.
+The visibility polygon is returned as a float64 array (m, 3) of intersections (x, y, angle) sorted by angle,
+the compiled backends (CythonVersion/Kernels.pyx and NumbaKernels.py) return the same polygon.
+
+With a segment grid (see SegmentGrid.py, grid_visibility_polygon) the rays are only intersected with the
+segments of the cells they cross. All the rays walk through the grid together (one cell per ray and per
+iteration) and leave the walk once their closest intersection lies in the cells already visited.
+
+This code comes with a MIT license.
+
+Copyright (c) 2018 Yoann Berenguer
+
+Please acknowledge and give reference if using the source code for your project
+"""
+
+__author__ = "Yoann Berenguer"
+__copyright__ = "Copyright 2007."
+__credits__ = ["Yoann Berenguer"]
+__license__ = "MIT License"
+__version__ = "2.0.0"
+__maintainer__ = "Yoann Berenguer"
+__email__ = "yoyoberenguer@hotmail.com"
+__status__ = "Demo"
+
+import math
+import numpy
+
+# Angle offset of the two extra rays cast around each segment end point
+RAY_OFFSET = 0.00001
+
+# Maximum size of the rays x segments matrices (the rays are processed by blocks to bound the memory)
+BLOCK_SIZE = 1 << 18
+
+
+def segment_array(segments_: list) -> numpy.ndarray:
+    """
+    Convert a list of segments {"a": {"x": .., "y": ..}, "b": {"x": .., "y": ..}} (see Constants.py)
+
+    :param segments_: list of segment dicts
+    :return: numpy.ndarray (n, 4) float64 segment end points (ax, ay, bx, by)
+    """
+    return numpy.array([(segment['a']['x'], segment['a']['y'], segment['b']['x'], segment['b']['y'])
+                        for segment in segments_], dtype=numpy.float64).reshape(-1, 4)
+
+
+def unique_corners(segments: numpy.ndarray) -> numpy.ndarray:
+    """
+    Return the unique end points of the segments (corners shared by adjacent segments are kept once).
+
+    :param segments: numpy.ndarray (n, 4) float64 segment end points (ax, ay, bx, by), see segment_array
+    :return: numpy.ndarray (k, 2) float64 corners (x, y)
+    """
+    return numpy.unique(segments.reshape(-1, 2), axis=0)
+
+
+def corner_angles(corners: numpy.ndarray, x: float, y: float) -> numpy.ndarray:
+    """
+    Return the angles of the rays cast from (x, y) towards the corners, sorted and deduplicated
+    (aligned corners are sharing the same rays).
+
+    :param corners: numpy.ndarray (k, 2) float64 corners returned by unique_corners
+    :param x: ray origin x coordinate (light or mouse position)
+    :param y: ray origin y coordinate
+    :return: numpy.ndarray (j, ) float64 C contiguous angles in radians
+    """
+    return numpy.unique(numpy.arctan2(corners[:, 1] - y, corners[:, 0] - x))
+
+
+def ray_directions(angles: numpy.ndarray, x: float, y: float) -> tuple:
+    """
+    Return the three rays cast towards each corner (angle - offset, angle, angle + offset).
+
+    :param angles: numpy.ndarray (j, ) float64 angles of the corners
+    :param x: ray origin x coordinate (light or mouse position)
+    :param y: ray origin y coordinate
+    :return: tuple of numpy.ndarray (3 * j, ) float64 (angles, r_dx, r_dy, r_mag)
+    """
+    angles = (angles[:, numpy.newaxis] + numpy.array((-RAY_OFFSET, 0, RAY_OFFSET))).ravel()
+    # same operations than the ray dict (b - a). The directions are calculated with libm (math.cos, math.sin)
+    # like Shadow.get_intersection and the compiled kernels, numpy.cos / numpy.sin are not always rounded
+    # to the same last bit and a ray aimed exactly at a corner can then miss it (T2 slightly > 1).
+    r_dx = (x + numpy.fromiter(map(math.cos, angles), dtype=numpy.float64, count=len(angles))) - x
+    r_dy = (y + numpy.fromiter(map(math.sin, angles), dtype=numpy.float64, count=len(angles))) - y
+    return angles, r_dx, r_dy, r_dx * r_dx + r_dy * r_dy
+
+
+def ray_parameters(r_dx, r_dy, r_mag, s_px, s_py, s_dx, s_dy, s_mag, x: float, y: float) -> numpy.ndarray:
+    """
+    Return the ray parameter T1 of the intersections between the rays and the segments (arrays broadcast
+    together), same arithmetic than Shadow.get_intersection. To be called with numpy.errstate(divide='ignore',
+    invalid='ignore').
+
+    :param r_dx, r_dy, r_mag: rays direction and squared magnitude (see ray_directions)
+    :param s_px, s_py, s_dx, s_dy, s_mag: segments end point a, direction and squared magnitude
+    :param x: ray origin x coordinate
+    :param y: ray origin y coordinate
+    :return: numpy.ndarray float64 T1, inf if the ray does not intersect the segment
+    """
+    # parallel lines, no intersection
+    parallel = (r_dx / r_mag == s_dx / s_mag) & (r_dy / r_mag == s_dy / s_mag)
+    d = s_dx * r_dy - s_dy * r_dx
+    t2 = (r_dx * (s_py - y) + r_dy * (x - s_px)) / numpy.where(d == 0, -0.01, d)
+    t1 = (s_px + s_dx * t2 - x) / numpy.where(r_dx == 0, -0.01, r_dx)
+
+    # intersections behind the ray or outside of the segment
+    t1[parallel | (t1 < 0) | (t2 < 0) | (t2 > 1)] = numpy.inf
+    return t1
+
+
+def polygon_points(angles: numpy.ndarray, r_dx: numpy.ndarray, r_dy: numpy.ndarray, closest: numpy.ndarray,
+                   x: float, y: float) -> numpy.ndarray:
+    """ return the intersections (x, y, angle) of the rays hitting a segment (closest T1 finite) sorted by angle """
+    hit = numpy.isfinite(closest)
+    polygon = numpy.column_stack((x + r_dx[hit] * closest[hit], y + r_dy[hit] * closest[hit], angles[hit]))
+    # stable sort, rays with identical angles are kept in the casting order
+    return numpy.ascontiguousarray(polygon[numpy.argsort(polygon[:, 2], kind='stable')])
+
+
+def visibility_polygon(segments: numpy.ndarray, x: float, y: float, angles: numpy.ndarray = None) -> numpy.ndarray:
+    """
+    Cast the rays from (x, y) and return the visibility polygon.
+
+    :param segments: numpy.ndarray (n, 4) float64 segment end points (ax, ay, bx, by), see segment_array
+    :param x: ray origin x coordinate (light or mouse position)
+    :param y: ray origin y coordinate
+    :param angles: numpy.ndarray (j, ) float64 angles of the corners returned by corner_angles,
+                   None to cast the rays towards the end point a of every segment
+    :return: numpy.ndarray (m, 3) float64 C contiguous, intersections (x, y, angle) sorted by angle
+    """
+    s_px, s_py = segments[:, 0], segments[:, 1]
+    s_dx = segments[:, 2] - s_px
+    s_dy = segments[:, 3] - s_py
+    s_mag = s_dx * s_dx + s_dy * s_dy
+
+    # three rays per corner (angle - offset, angle, angle + offset)
+    if angles is None:
+        angles = numpy.arctan2(s_py - y, s_px - x)
+    angles, r_dx, r_dy, r_mag = ray_directions(angles, x, y)
+
+    rays = len(angles)
+    closest = numpy.empty(rays, dtype=numpy.float64)
+    block = max(1, BLOCK_SIZE // max(1, len(segments)))
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, rays, block):
+            ray = slice(start, start + block)
+            t1 = ray_parameters(r_dx[ray, numpy.newaxis], r_dy[ray, numpy.newaxis], r_mag[ray, numpy.newaxis],
+                                s_px, s_py, s_dx, s_dy, s_mag, x, y)
+            # closest intersection of each ray (inf if none)
+            closest[ray] = t1.min(axis=1)
+
+    return polygon_points(angles, r_dx, r_dy, closest, x, y)
+
+
+def grid_visibility_polygon(grid, x: float, y: float, angles: numpy.ndarray = None) -> numpy.ndarray:
+    """
+    Cast the rays from (x, y) through the segment grid and return the visibility polygon
+    (same polygon than visibility_polygon with all the segments).
+
+    :param grid: SegmentGrid.GridIndex (see SegmentGrid.index)
+    :param x: ray origin x coordinate (light or mouse position)
+    :param y: ray origin y coordinate
+    :param angles: numpy.ndarray (j, ) float64 angles of the corners returned by corner_angles,
+                   None to cast the rays towards the end point a of every segment
+    :return: numpy.ndarray (m, 3) float64 C contiguous, intersections (x, y, angle) sorted by angle
+    """
+    segments, cell_start, cell_segments = grid.segments, grid.cell_start, grid.cell_segments
+    cell_size, columns, rows = grid.cell_size, grid.columns, grid.rows
+    s_px, s_py = segments[:, 0], segments[:, 1]
+    s_dx = segments[:, 2] - s_px
+    s_dy = segments[:, 3] - s_py
+    s_mag = s_dx * s_dx + s_dy * s_dy
+
+    if angles is None:
+        angles = numpy.arctan2(s_py - y, s_px - x)
+    angles, r_dx, r_dy, r_mag = ray_directions(angles, x, y)
+    closest = numpy.full(len(angles), numpy.inf)
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        # vertical rays (r_dx == 0), T1 is not a distance along the ray, intersected with all the segments
+        ray = numpy.flatnonzero(r_dx == 0)
+        if len(ray) and len(segments):
+            closest[ray] = ray_parameters(r_dx[ray, numpy.newaxis], r_dy[ray, numpy.newaxis],
+                                          r_mag[ray, numpy.newaxis], s_px, s_py, s_dx, s_dy, s_mag, x, y).min(axis=1)
+
+        # rays entering the grid (slab method), T1 of the grid entry and exit
+        ray = numpy.flatnonzero(r_dx != 0)
+        dx, dy = r_dx[ray], r_dy[ray]
+        tx0, tx1 = (grid.left - x) / dx, (grid.left + columns * cell_size - x) / dx
+        ty0, ty1 = (grid.top - y) / dy, (grid.top + rows * cell_size - y) / dy
+        inside_y = grid.top <= y <= grid.top + rows * cell_size
+        t_enter = numpy.maximum(numpy.maximum(numpy.minimum(tx0, tx1), 0),
+                                numpy.where(dy == 0, -numpy.inf if inside_y else numpy.inf, numpy.minimum(ty0, ty1)))
+        t_leave = numpy.minimum(numpy.maximum(tx0, tx1), numpy.where(dy == 0, numpy.inf, numpy.maximum(ty0, ty1)))
+        entering = t_enter <= t_leave
+        ray, dx, dy, t_enter = ray[entering], dx[entering], dy[entering], t_enter[entering]
+
+        # first cell and DDA state of each ray
+        column = numpy.clip(numpy.floor((x + dx * t_enter - grid.left) / cell_size), 0, columns - 1).astype(numpy.int64)
+        row = numpy.clip(numpy.floor((y + dy * t_enter - grid.top) / cell_size), 0, rows - 1).astype(numpy.int64)
+        step_x, step_y = numpy.sign(dx).astype(numpy.int64), numpy.sign(dy).astype(numpy.int64)
+        t_max_x = (grid.left + (column + (dx > 0)) * cell_size - x) / dx
+        t_max_y = numpy.where(dy == 0, numpy.inf, (grid.top + (row + (dy > 0)) * cell_size - y) / dy)
+        t_delta_x = cell_size / numpy.abs(dx)
+        t_delta_y = numpy.where(dy == 0, numpy.inf, cell_size / numpy.abs(dy))
+
+        while len(ray):
+            # segments of the current cell of each ray, (ray, segment) pairs
+            cell = row * columns + column
+            start, count = cell_start[cell], cell_start[cell + 1] - cell_start[cell]
+            owner = numpy.repeat(numpy.arange(len(ray)), count)
+            pair = numpy.arange(len(owner)) - numpy.repeat(numpy.cumsum(count) - count - start, count)
+            segment = cell_segments[pair]
+            hit = ray[owner]
+            numpy.minimum.at(closest, hit, ray_parameters(r_dx[hit], r_dy[hit], r_mag[hit],
+                                                          s_px[segment], s_py[segment], s_dx[segment],
+                                                          s_dy[segment], s_mag[segment], x, y))
+
+            # closest intersection within the visited cells, the ray leaves the walk
+            t_exit = numpy.minimum(t_max_x, t_max_y)
+            walking = closest[ray] > t_exit
+            # next cell
+            along_x = t_max_x < t_max_y
+            column = column + numpy.where(along_x, step_x, 0)
+            row = row + numpy.where(along_x, 0, step_y)
+            t_max_x = numpy.where(along_x, t_max_x + t_delta_x, t_max_x)
+            t_max_y = numpy.where(along_x, t_max_y, t_max_y + t_delta_y)
+            walking &= (column >= 0) & (column < columns) & (row >= 0) & (row < rows)
+
+            ray, column, row, step_x, step_y = ray[walking], column[walking], row[walking], \
+                step_x[walking], step_y[walking]
+            t_max_x, t_max_y, t_delta_x, t_delta_y = t_max_x[walking], t_max_y[walking], \
+                t_delta_x[walking], t_delta_y[walking]
+
+    return polygon_points(angles, r_dx, r_dy, closest, x, y)
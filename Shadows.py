@@ -14,18 +14,38 @@ __status__ = "Demo"
 import pygame
 from pygame import gfxdraw
 import math
+import numpy
 from Constants import UNSHADOWED_TEXTURE1, MOUSE_POS, SCREEN
+from Backends import get_backend
+from ShadowKernels import segment_array, unique_corners, corner_angles
+from SegmentGrid import SegmentGrid
+
+# Texture of the visibility polygons without its surface alpha, the alpha is applied per pixel
+# to the pre-rendered polygons (see Shadow.render_polygon)
+OPAQUE_TEXTURE1 = UNSHADOWED_TEXTURE1.copy()
+OPAQUE_TEXTURE1.set_alpha(None)
+TEXTURE_ALPHA = UNSHADOWED_TEXTURE1.get_alpha() if UNSHADOWED_TEXTURE1.get_alpha() is not None else 255
 
 
 class Shadow:
 
-    def __init__(self, polygons_, static_=False, location_=None):
+    def __init__(self, polygons_, static_=False, location_=None, cell_size_=None):
+        """
+        :param polygons_: list of segments {"a": {"x": .., "y": ..}, "b": {"x": .., "y": ..}}
+        :param static_: bool; True for a shadow projected from a fixed light location
+        :param location_: tuple (x, y) light location of a static shadow
+        :param cell_size_: int; cell size of the segment grid in pixels (see SegmentGrid.py), None to intersect
+                           the rays with all the segments. The grid is worth it for large levels (thousands of
+                           segments), 32 to 64 pixels cells are a good start.
+        """
         assert isinstance(polygons_, list), 'Expecting list for ' \
                                             'argument polygons_ got %s ' % type(polygons_)
         assert isinstance(static_, bool), 'Expecting bool for ' \
                                           'argument static_ got %s ' % type(static_)
         assert isinstance(location_, (type(None), tuple)), 'Expecting tuple or None for ' \
                                                            'argument location_ got %s ' % type(location_)
+        assert isinstance(cell_size_, (type(None), int)), 'Expecting int or None for ' \
+                                                          'argument cell_size_ got %s ' % type(cell_size_)
         self.static = static_
         if self.static is True:
             assert isinstance(location_, tuple), 'Expecting tuple for ' \
@@ -33,7 +53,73 @@ class Shadow:
         self.location = location_
         self.intersects = []
         self.points = []
-        self.segments = polygons_
+        # pre-rendered visibility polygon and the polygon it was rendered from (see visibility_surface)
+        self.mask = None
+        self.mask_polygon = None
+        self.cell_size = cell_size_
+        # segment list version, incremented every time the segments are changed
+        self.version = 0
+        self.set_segments(polygons_)
+
+    def set_segments(self, segments_: list):
+        """
+        Set the occluder segments and pre-process them for the shadow casting kernels (see Backends.py).
+        The unique corners and the segment grid (cell_size set) are built once here, the angles of the rays
+        are calculated once per ray origin.
+        The segments must not be modified in place (the visibility polygon is cached, see update), use
+        add_segment and remove_segment instead.
+
+        :param segments_: list of segments {"a": {"x": .., "y": ..}, "b": {"x": .., "y": ..}}
+        """
+        assert isinstance(segments_, list), 'Expecting list for ' \
+                                            'argument segments_ got %s ' % type(segments_)
+        self.segments = segments_
+        # segment end points (ax, ay, bx, by)
+        self.segment_array = segment_array(segments_)
+        self.grid = SegmentGrid(self.segment_array, self.cell_size) if self.cell_size is not None else None
+        self.segments_changed()
+
+    def add_segment(self, segment_: dict):
+        """
+        Add an occluder segment, the segment grid is updated incrementally.
+
+        :param segment_: segment {"a": {"x": .., "y": ..}, "b": {"x": .., "y": ..}}
+        """
+        assert isinstance(segment_, dict), 'Expecting dict for ' \
+                                           'argument segment_ got %s ' % type(segment_)
+        # new list, the segment list can be shared with other shadows
+        self.segments = self.segments + [segment_]
+        self.segment_array = numpy.vstack((self.segment_array, segment_array([segment_])))
+        if self.grid is not None:
+            self.grid.add(tuple(self.segment_array[-1]))
+        self.segments_changed()
+
+    def remove_segment(self, segment_: dict):
+        """
+        Remove an occluder segment, the segment grid is updated incrementally.
+
+        :param segment_: segment {"a": {"x": .., "y": ..}, "b": {"x": .., "y": ..}}
+        :raise ValueError: if the segment is not in the segment list
+        """
+        assert isinstance(segment_, dict), 'Expecting dict for ' \
+                                           'argument segment_ got %s ' % type(segment_)
+        index = self.segments.index(segment_)
+        self.segments = self.segments[:index] + self.segments[index + 1:]
+        self.segment_array = numpy.delete(self.segment_array, index, axis=0)
+        if self.grid is not None:
+            self.grid.remove(tuple(segment_array([segment_])[0]))
+        self.segments_changed()
+
+    def segments_changed(self):
+        """ Rebuild the corners and invalidate the cached angles and visibility polygon (see update) """
+        # unique segment end points (x, y)
+        self.corners = unique_corners(self.segment_array)
+        # sorted angles of the corners seen from self.origin (see update)
+        self.angles = None
+        self.origin = None
+        # segment list version and (origin, version) of the cached visibility polygon
+        self.version += 1
+        self.polygon_key = None
 
     @staticmethod
     def get_intersection(ray, segment):
@@ -88,80 +174,94 @@ class Shadow:
         }
 
     def update(self, mouse_position):
+        """
+        Calculate the visibility polygon from the light location (static shadow) or the mouse position
+        with the shadow casting kernel of the compute backend (see Backends.py).
+        self.intersects is a numpy.ndarray (m, 3) float64 (x, y, angle) sorted by angle.
+        The polygon is re-calculated only when the ray origin or the segments (see set_segments) are changing,
+        static shadows are calculated once.
+
+        :param mouse_position: tuple (x, y) mouse position
+        """
         assert isinstance(mouse_position, tuple), 'Expecting tuple for ' \
                                             'argument mouse_position got %s ' % type(mouse_position)
-        # Clear old points
-        self.points = []
-        for segment in self.segments:
-            self.points.append((segment['a'], segment['b']))
-
-        unique_points = self.points.copy()
-
-        # Get all angles in radian
-        unique_angles = []
-        for point in unique_points:
-            if self.static:
-                angle = math.atan2(point[0]["y"] - self.location[1], point[0]["x"] - self.location[0])
-            else:
-                angle = math.atan2(point[0]["y"] - mouse_position[1], point[0]["x"] - mouse_position[0])
-            point[0]["angle"] = angle
-            # For each (unique) line segment end point,
-            # I cast a ray directly towards it,
-            # plus two more rays offset by +/- 0.00001 radians.
-            # The two extra rays are needed to hit the wall(s) behind any given segment corner.
-            unique_angles.append(angle - 0.00001)
-            unique_angles.append(angle)
-            unique_angles.append(angle + 0.00001)
-
-        # RAYS IN ALL DIRECTIONS
-        self.intersects = []
-        for angle in unique_angles:
-
-            dx = math.cos(angle)
-            dy = math.sin(angle)
-            # Ray,
-            # segment (a) is the mouse position (also ray origin)
-            # segment (b) is the slope or direction
-
-            if self.static:
-                ray = {
-                    "a": {"x": self.location[0], "y": self.location[1]},
-                    "b": {"x": self.location[0] + dx, "y": self.location[1] + dy}
-                }
-            else:
-                ray = {
-                    "a": {"x": mouse_position[0], "y": mouse_position[1]},
-                    "b": {"x": mouse_position[0] + dx, "y": mouse_position[1] + dy}
-                }
-
-            # Find CLOSEST intersection
-            closest_intersect = None
-            for segment in self.segments:
-
-                # return the point of intersection (coordinates x, y, T1) if any (else return None)
-                intersect = self.get_intersection(ray, segment)
-                # if no intersection, loop back
-                if not intersect:
-                    continue
-
-                if not closest_intersect or intersect["T1"] < closest_intersect["T1"]:
-                    closest_intersect = intersect
-
-            if not closest_intersect:
-                continue
-
-            closest_intersect["angle"] = angle
-            self.intersects.append(closest_intersect)
-        self.intersects = sorted(self.intersects, key=lambda k: k['angle'])
+        origin = self.location if self.static else mouse_position
+        key = (origin, self.version)
+        if key == self.polygon_key:
+            return
+
+        if origin != self.origin:
+            self.angles = corner_angles(self.corners, *origin)
+            self.origin = origin
+        if self.grid is not None:
+            self.intersects = get_backend().grid_visibility_polygon(self.grid.index(), *origin, self.angles)
+        else:
+            self.intersects = get_backend().visibility_polygon(self.segment_array, *origin, self.angles)
+        self.polygon_key = key
 
     @staticmethod
-    def draw_polygon(polygon):
-        assert isinstance(polygon, list), 'Expecting list for ' \
+    def draw_polygon(polygon, surface_=None):
+        assert isinstance(polygon, (list, numpy.ndarray)), 'Expecting list or numpy.ndarray for ' \
                                                   'argument polygon got %s ' % type(polygon)
-        points = []
-        for intersect in polygon:
-            points.append((intersect['x'], intersect['y']))
-        pygame.gfxdraw.textured_polygon(SCREEN, points, UNSHADOWED_TEXTURE1, 0, 0)
+        if isinstance(polygon, numpy.ndarray):
+            points = polygon[:, :2].tolist()
+        else:
+            points = []
+            for intersect in polygon:
+                points.append((intersect['x'], intersect['y']))
+        pygame.gfxdraw.textured_polygon(SCREEN if surface_ is None else surface_, points, UNSHADOWED_TEXTURE1, 0, 0)
+
+    @staticmethod
+    def render_polygon(polygon):
+        """
+        Render the textured visibility polygon into a new surface cropped to the polygon bounding box.
+        The texture alpha is applied per pixel, the surface is drawn with a plain blit (same result than
+        draw_polygon within 1 LSB, overlapping spans of the polygon are not blended twice).
+
+        :param polygon: numpy.ndarray (m, 3) (x, y, angle) or list of intersect dicts
+        :return: tuple (pygame.Surface, (left, top)) or None if the polygon is empty
+        """
+        if isinstance(polygon, numpy.ndarray):
+            points = polygon[:, :2]
+        else:
+            points = numpy.array([(intersect['x'], intersect['y']) for intersect in polygon]).reshape(-1, 2)
+        if len(points) < 3:
+            return None
+
+        left, top = int(math.floor(points[:, 0].min())), int(math.floor(points[:, 1].min()))
+        size = (int(math.ceil(points[:, 0].max())) - left + 1, int(math.ceil(points[:, 1].max())) - top + 1)
+        surface = pygame.Surface(size, pygame.SRCALPHA, 32)
+        # the texture stays aligned with the screen (texture offset x is subtracted, y is added)
+        pygame.gfxdraw.textured_polygon(surface, (points - (left, top)).tolist(), OPAQUE_TEXTURE1, -left, top)
+
+        # the views are locking the surface and must be released before converting
+        alpha = pygame.surfarray.pixels_alpha(surface)
+        alpha[alpha > 0] = TEXTURE_ALPHA
+        del alpha
+        return surface.convert_alpha(), (left, top)
+
+    def visibility_surface(self, polygon_=None):
+        """
+        Return the pre-rendered visibility polygon (see render_polygon), rendered once per polygon: static
+        shadows are rendered once, dynamic shadows only when their polygon changes (see update).
+
+        :param polygon_: visibility polygon or None for the current polygon (self.intersects)
+        :return: tuple (pygame.Surface, (left, top)) or None if the polygon is empty
+        """
+        polygon = self.intersects if polygon_ is None else polygon_
+        if polygon is not self.mask_polygon:
+            self.mask = self.render_polygon(polygon)
+            self.mask_polygon = polygon
+        return self.mask
+
+    def render_frame(self, surface_=None, polygon_=None):
+        """
+        Draw the visibility polygon onto surface_ (default SCREEN)
 
-    def render_frame(self):
-        self.draw_polygon(self.intersects)
+        :param surface_: pygame.Surface or None for SCREEN
+        :param polygon_: visibility polygon or None for the current polygon (e.g polygon computed
+                         ahead by a pipelined frame)
+        """
+        mask = self.visibility_surface(polygon_)
+        if mask is not None:
+            (SCREEN if surface_ is None else surface_).blit(*mask)
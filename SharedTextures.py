@@ -0,0 +1,105 @@
+"""
+Textures shared with the light worker processes (see LightDemoMultProcess.py).
+
+The background texture, the masks alpha and the volumetric textures are copied once into shared memory
+blocks (multiprocessing.shared_memory), the workers attach to the blocks by name. Requests sent through the
+multiprocessing queues only carry small descriptors (block name, array shape and data type) instead of the
+pickled arrays.
+
+Main process :
+    textures = SharedTextures()
+    descriptor = textures.share('RGB1', RGB1)
+    ...
+    textures.close()
+
+Worker process :
+    rgb = attach(descriptor)
+    ...
+    detach()
+
+This code comes with a MIT license.
+
+Copyright (c) 2018 Yoann Berenguer
+
+Please acknowledge and give reference if using the source code for your project
+"""
+
+__author__ = "Yoann Berenguer"
+__copyright__ = "Copyright 2007."
+__credits__ = ["Yoann Berenguer"]
+__license__ = "MIT License"
+__version__ = "2.0.0"
+__maintainer__ = "Yoann Berenguer"
+__email__ = "yoyoberenguer@hotmail.com"
+__status__ = "Demo"
+
+import numpy
+from multiprocessing import shared_memory
+
+# Shared memory blocks attached by the current process {block name: (SharedMemory, numpy.ndarray)}
+ATTACHED = {}
+
+
+class SharedTextures:
+    """ Shared memory blocks created by the main process. """
+
+    def __init__(self):
+        # {key: (SharedMemory, descriptor)}
+        self.blocks = {}
+
+    def share(self, key_, array_: numpy.ndarray) -> tuple:
+        """
+        Copy an array into a new shared memory block (once per key) and return its descriptor.
+
+        :param key_: hashable key identifying the array (e.g 'RGB1'), an array already shared
+                     under the same key is not copied again.
+        :param array_: numpy.ndarray
+        :return: tuple descriptor (block name, shape, dtype) to be sent to the workers (see attach)
+        """
+        assert isinstance(array_, numpy.ndarray), \
+            'Expecting numpy.ndarray for argument array_ got %s ' % type(array_)
+
+        block = self.blocks.get(key_)
+        if block is not None:
+            return block[1]
+
+        shm = shared_memory.SharedMemory(create=True, size=max(array_.nbytes, 1))
+        numpy.ndarray(array_.shape, dtype=array_.dtype, buffer=shm.buf)[...] = array_
+        descriptor = (shm.name, array_.shape, array_.dtype.str)
+        self.blocks[key_] = (shm, descriptor)
+        return descriptor
+
+    def close(self):
+        """ Release all the shared memory blocks (to be called once the workers are stopped) """
+        for shm, _ in self.blocks.values():
+            shm.close()
+            shm.unlink()
+        self.blocks.clear()
+
+
+def attach(descriptor_: tuple) -> numpy.ndarray:
+    """
+    Return a numpy view of a shared memory block, the block is attached once per process.
+
+    :param descriptor_: tuple (block name, shape, dtype) returned by SharedTextures.share
+    :return: numpy.ndarray sharing the block memory (do not modify)
+    """
+    name, shape, dtype = descriptor_
+    block = ATTACHED.get(name)
+    if block is None:
+        shm = shared_memory.SharedMemory(name=name)
+        block = (shm, numpy.ndarray(shape, dtype=numpy.dtype(dtype), buffer=shm.buf))
+        ATTACHED[name] = block
+    return block[1]
+
+
+def detach():
+    """
+    Close the shared memory blocks attached by the current process (to be called by the workers before
+    exiting, the views returned by attach must be released first). The blocks are released by the main
+    process (see SharedTextures.close).
+    """
+    blocks = [shm for shm, _ in ATTACHED.values()]
+    ATTACHED.clear()
+    for shm in blocks:
+        shm.close()
@@ -0,0 +1,122 @@
+"""
+Bounded LRU cache of rendered light surfaces.
+
+The cache maps a light animation state (light id, color, rotation frame, volume frame ...) to the finished
+light surface (see CreateLight.spotlight and CreateLight.SURFACE_CACHE). Lights revisiting the same states
+(e.g ping-pong color gradients revisit every color index twice per cycle) are then drawn with the cached
+surface instead of being re-calculated.
+The least recently used surfaces are evicted when the total size of the cached surfaces exceeds the budget.
+The cache can be shared by several threads.
+
+This code comes with a MIT license.
+
+Copyright (c) 2018 Yoann Berenguer
+
+Please acknowledge and give reference if using the source code for your project
+"""
+
+__author__ = "Yoann Berenguer"
+__copyright__ = "Copyright 2007."
+__credits__ = ["Yoann Berenguer"]
+__license__ = "MIT License"
+__version__ = "2.0.0"
+__maintainer__ = "Yoann Berenguer"
+__email__ = "yoyoberenguer@hotmail.com"
+__status__ = "Demo"
+
+import threading
+from collections import OrderedDict
+
+import pygame
+
+
+class SurfaceCache:
+    """ Least recently used cache of pygame surfaces bounded by their size in bytes. """
+
+    def __init__(self, max_bytes_: int):
+        """
+        :param max_bytes_: int; maximum size in bytes of the cached surfaces
+        """
+        assert isinstance(max_bytes_, int), \
+            'Expecting int for argument max_bytes_ got %s ' % type(max_bytes_)
+        assert max_bytes_ > 0, 'argument max_bytes_ should be > 0, got %s ' % max_bytes_
+
+        self.max_bytes = max_bytes_
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # {key: (surface, size in bytes)} ordered from the least to the most recently used
+        self.surfaces = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.surfaces)
+
+    @staticmethod
+    def surface_size(surface_: pygame.Surface) -> int:
+        """ return the size in bytes of the surface pixels """
+        return surface_.get_pitch() * surface_.get_height()
+
+    def get(self, key_):
+        """
+        Return the surface cached for key_ (marked as most recently used) or None
+
+        :param key_: hashable animation state
+        :return: pygame.Surface or None
+        """
+        with self.lock:
+            entry = self.surfaces.get(key_)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.surfaces.move_to_end(key_)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key_, surface_: pygame.Surface):
+        """
+        Cache a surface, the least recently used surfaces are evicted to stay within the budget.
+        The surface is stored as is and must not be modified afterward (pass a copy).
+        Surfaces larger than the whole budget are not cached.
+
+        :param key_: hashable animation state
+        :param surface_: pygame.Surface
+        """
+        size = self.surface_size(surface_)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            entry = self.surfaces.pop(key_, None)
+            if entry is not None:
+                self.size -= entry[1]
+
+            while self.size + size > self.max_bytes:
+                self.size -= self.surfaces.popitem(last=False)[1][1]
+                self.evictions += 1
+
+            self.surfaces[key_] = (surface_, size)
+            self.size += size
+
+    def discard(self, owner_):
+        """
+        Remove all the surfaces of a light (keys starting with the light id), e.g after a light change.
+
+        :param owner_: light id (first item of the cache keys)
+        """
+        with self.lock:
+            for key in [key for key in self.surfaces if key[0] == owner_]:
+                self.size -= self.surfaces.pop(key)[1]
+
+    def clear(self):
+        """ Remove all the cached surfaces and reset the counters """
+        with self.lock:
+            self.surfaces.clear()
+            self.size = self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """ return the cache counters (hits, misses, evictions, entries and size in bytes) """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.surfaces), 'bytes': self.size}